@@ -0,0 +1,71 @@
+"""
+Event-loop lag monitor and blocking-call detector.
+
+A heartbeat task sleeps for `interval` and records how late it wakes up; the
+overshoot is the time the loop spent running something else without yielding.
+In debug mode a watchdog thread also watches the heartbeat and, when the loop
+has been stuck longer than `threshold`, logs the loop thread's current stack so
+the blocking call (psycopg2 query, time.sleep, DNS lookup, ...) can be found.
+"""
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+class LoopMonitor:
+    def __init__(self, lag_histogram, blocked_counter, interval: float = 0.1,
+                 debug: bool = False, threshold: float = 0.1):
+        self.lag_histogram = lag_histogram
+        self.blocked_counter = blocked_counter
+        self.interval = interval
+        self.debug = debug
+        self.threshold = threshold
+        self.heartbeat = time.monotonic()
+        self.loop_thread_id = None
+        self.task = None
+        self.watchdog = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.task = asyncio.create_task(self._measure())
+        if self.debug:
+            self.watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self.watchdog.start()
+
+    async def stop(self):
+        self.stopped.set()
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    async def _measure(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lag_histogram.observe(max(loop.time() - expected, 0.0))
+            self.heartbeat = time.monotonic()
+
+    def _watch(self):
+        reported = None
+        while not self.stopped.wait(self.threshold / 2):
+            heartbeat = self.heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled < self.threshold or reported == heartbeat:
+                continue
+            # Report each stall once, at the point it crosses the threshold
+            reported = heartbeat
+            self.blocked_counter.inc()
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "<no frame>"
+            logger.warning("Event loop blocked for more than %.0fms:\n%s", stalled * 1000, stack)
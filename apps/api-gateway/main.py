@@ -1,12 +1,20 @@
 import os
+import hmac
+import math
+import hashlib
 import time
+import asyncio
 import socket
 import httpx
 import logging
-from typing import Dict, Any
+from typing import Dict, Optional
+from urllib.parse import parse_qsl
+from contextlib import asynccontextmanager, contextmanager
 from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from starlette.background import BackgroundTask
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
 from opentelemetry import trace
 from opentelemetry.exporter.jaeger.thrift import JaegerExporter
 from opentelemetry.sdk.trace import TracerProvider
@@ -14,8 +22,23 @@ from opentelemetry.sdk.trace.export import BatchSpanProcessor
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 from opentelemetry.instrumentation.httpx import HTTPXClientInstrumentor
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+import profiler
+import log_setup
+import payload_codec
+from loop_monitor import LoopMonitor
+from query_cache import QueryRangeCache, CacheBypass
+from rate_limit import MemoryTokenBucketStore, RedisTokenBucketStore
+from router import Route, Router, MethodNotAllowed, load_route_table, default_routes_file
+
+# Configure logging: records go through a queue to a background writer as JSON lines with trace ids;
+# repeated warnings/errors from the same call site are rate-limited
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_RATE_LIMIT_BURST = int(os.getenv("LOG_RATE_LIMIT_BURST", "10"))
+LOG_RATE_LIMIT_WINDOW = float(os.getenv("LOG_RATE_LIMIT_WINDOW", "60"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+ACCESS_LOG = os.getenv("ACCESS_LOG", "true").lower() == "true"
+log_setup.configure("api-gateway", LOG_LEVEL, LOG_FORMAT, LOG_RATE_LIMIT_BURST, LOG_RATE_LIMIT_WINDOW, LOG_QUEUE_SIZE)
 logger = logging.getLogger(__name__)
 
 # Initialize OpenTelemetry
@@ -34,15 +57,39 @@ if jaeger_enabled:
         trace.get_tracer_provider().add_span_processor(span_processor)
         logger.info("Jaeger tracing enabled")
     except Exception as e:
-        logger.warning(f"Failed to initialize Jaeger: {e}")
+        logger.warning("Failed to initialize Jaeger: %s", e)
 else:
     logger.info("Jaeger tracing disabled")
 
+# Event-loop lag monitoring; LOOP_BLOCK_DEBUG also logs the stack of any stall over the threshold
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL_MS", "100")) / 1000
+LOOP_BLOCK_DEBUG = os.getenv("LOOP_BLOCK_DEBUG", "false").lower() == "true"
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100")) / 1000
+loop_monitor = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup
+    global loop_monitor
+    loop_monitor = LoopMonitor(EVENT_LOOP_LAG, EVENT_LOOP_BLOCKED, LOOP_MONITOR_INTERVAL,
+                               LOOP_BLOCK_DEBUG, LOOP_BLOCK_THRESHOLD)
+    loop_monitor.start()
+    yield
+    # Shutdown
+    await loop_monitor.stop()
+    if http_client:
+        await http_client.aclose()
+    if stream_http_client:
+        await stream_http_client.aclose()
+    if shared_rate_limit_store:
+        await shared_rate_limit_store.close()
+
 # Initialize FastAPI
 app = FastAPI(
     title="API Gateway",
     description="API Gateway for K8s 3-Tier Observability Lab",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Instrument FastAPI and httpx
@@ -71,6 +118,61 @@ REQUEST_DURATION = Histogram(
     ['method', 'endpoint']
 )
 
+EVENT_LOOP_LAG = Histogram(
+    'api_gateway_event_loop_lag_seconds',
+    'Delay between scheduled and actual wake-up of the event loop heartbeat',
+    buckets=[.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5]
+)
+
+EVENT_LOOP_BLOCKED = Counter(
+    'api_gateway_event_loop_blocked_total',
+    'Event loop stalls longer than LOOP_BLOCK_THRESHOLD_MS (debug mode only)'
+)
+
+PHASE_DURATION = Histogram(
+    'api_gateway_phase_duration_seconds',
+    'Time spent in each phase of request handling',
+    ['phase', 'upstream'],
+    buckets=[.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10]
+)
+
+@contextmanager
+def timed_phase(phase: str, upstream: str):
+    """Record the duration of one request phase (upstream_wait, serialization)"""
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        PHASE_DURATION.labels(phase=phase, upstream=upstream).observe(time.perf_counter() - start_time)
+
+# Admin endpoints are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def require_admin(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    authorization = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(authorization, f"Bearer {ADMIN_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+QUERY_CACHE_REQUESTS = Counter(
+    'api_gateway_query_cache_requests_total',
+    'Prometheus query_range requests served through the range cache',
+    ['outcome']
+)
+
+QUERY_CACHE_SAMPLES = Gauge(
+    'api_gateway_query_cache_samples',
+    'Samples currently held by the Prometheus query_range cache'
+)
+
+# Prometheus query_range cache; samples newer than QUERY_CACHE_FRESHNESS seconds are always refetched
+QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "true").lower() == "true"
+query_range_cache = QueryRangeCache(
+    max_samples=int(os.getenv("QUERY_CACHE_MAX_SAMPLES", "500000")),
+    freshness=float(os.getenv("QUERY_CACHE_FRESHNESS", "60")),
+) if QUERY_CACHE_ENABLED else None
+
 # Service endpoints
 SERVICES = {
     "order": os.getenv("ORDER_SERVICE_URL", "http://order-service:8080"),
@@ -78,6 +180,67 @@ SERVICES = {
     "user": os.getenv("USER_SERVICE_URL", "http://user-service:8000"),
 }
 
+RATE_LIMITED = Counter(
+    'api_gateway_rate_limited_total',
+    'Requests rejected by the rate limiter',
+    ['route']
+)
+
+RATE_LIMIT_BACKEND_ERRORS = Counter(
+    'api_gateway_rate_limit_backend_errors_total',
+    'Shared rate limit store failures (the local store was used instead)'
+)
+
+COMPACT_RESPONSES = Counter(
+    'api_gateway_compact_responses_total',
+    'Compact upstream list responses, by upstream encoding and encoding sent to the client',
+    ['upstream', 'client']
+)
+
+# Per-client token-bucket rate limiting; routes.yaml may override rate/burst per route
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "false").lower() == "true"
+RATE_LIMIT_RATE = float(os.getenv("RATE_LIMIT_RATE", "20"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "40"))
+RATE_LIMIT_PER_ROUTE = os.getenv("RATE_LIMIT_PER_ROUTE", "true").lower() == "true"
+# Header carrying an API key that something in front of the gateway has already authenticated;
+# unset by default, since an unverified key is just another value the client can change at will
+RATE_LIMIT_API_KEY_HEADER = os.getenv("RATE_LIMIT_API_KEY_HEADER", "")
+# Proxies in front of the gateway that append to X-Forwarded-For (e.g. 1 behind the Istio ingress
+# gateway). The client address is that many hops from the right; anything further left was sent by
+# the client and is ignored. 0 uses the peer address only.
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+
+# After a Redis failure, local buckets are used for this many seconds before Redis is tried again
+RATE_LIMIT_REDIS_RETRY = float(os.getenv("RATE_LIMIT_REDIS_RETRY", "5"))
+
+local_rate_limit_store = MemoryTokenBucketStore(max_keys=int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000")))
+shared_rate_limit_store = RedisTokenBucketStore(
+    os.getenv("RATE_LIMIT_REDIS_URL", "redis://redis:6379/0"),
+    timeout=float(os.getenv("RATE_LIMIT_REDIS_TIMEOUT_MS", "100")) / 1000
+) if RATE_LIMIT_ENABLED and RATE_LIMIT_BACKEND == "redis" else None
+shared_rate_limit_retry_at = 0.0
+
+# Upstream base URLs; the route table file may add or override entries
+UPSTREAMS = {
+    **SERVICES,
+    "prometheus": os.getenv("PROMETHEUS_URL", "http://monitoring-stack-kube-prom-prometheus.monitoring:9090"),
+    "grafana": os.getenv("GRAFANA_URL", "http://monitoring-stack-grafana.monitoring.svc.cluster.local:80"),
+    "jaeger": os.getenv("JAEGER_URL", "http://jaeger-query.istio-system.svc.cluster.local:16686"),
+    "kiali": os.getenv("KIALI_URL", "http://kiali.istio-system.svc.cluster.local:20001"),
+}
+
+# Route table (routes.yaml unless GATEWAY_ROUTES_FILE is set), compiled into a prefix tree
+UPSTREAMS, ROUTES = load_route_table(os.getenv("GATEWAY_ROUTES_FILE", default_routes_file()), UPSTREAMS)
+UPSTREAMS = {name: url.rstrip("/") for name, url in UPSTREAMS.items()}
+router = Router(ROUTES)
+
+# Hop-by-hop headers are never forwarded in either direction
+HOP_BY_HOP_HEADERS = {"host", "content-length", "connection", "keep-alive", "proxy-connection",
+                      "transfer-encoding", "te", "trailer", "upgrade"}
+# json/health routes only pass on what the upstream needs to interpret the request
+API_FORWARDED_HEADERS = {"content-type", "x-client-id"}
+
 # Get pod information
 POD_NAME = os.getenv("HOSTNAME", socket.gethostname())
 POD_IP = socket.gethostbyname(socket.gethostname())
@@ -105,6 +268,10 @@ async def add_process_time_header(request: Request, call_next):
         endpoint=request.url.path
     ).observe(process_time)
     
+    if ACCESS_LOG:
+        log_setup.log_access(request.method, request.url.path, response.status_code, process_time,
+                             request.client.host if request.client else None)
+    
     return response
 
 @app.get("/health")
@@ -124,6 +291,24 @@ async def metrics():
     """Prometheus metrics endpoint"""
     return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
+@app.get("/admin/profile")
+async def admin_profile(request: Request, seconds: float = 10, interval_ms: float = 5, format: str = "collapsed"):
+    """Capture a sampling CPU profile as collapsed stacks or speedscope JSON"""
+    require_admin(request)
+    if not 0 < seconds <= 60 or not 1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="seconds must be in (0, 60] and interval_ms in [1, 1000]")
+    if format not in ("collapsed", "speedscope"):
+        raise HTTPException(status_code=400, detail="format must be 'collapsed' or 'speedscope'")
+    
+    try:
+        stacks = await asyncio.to_thread(profiler.sample, seconds, interval_ms / 1000)
+    except profiler.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    if format == "speedscope":
+        return profiler.to_speedscope(stacks, interval_ms / 1000, f"api-gateway {POD_NAME}")
+    return Response(profiler.to_collapsed(stacks), media_type="text/plain")
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -137,223 +322,180 @@ async def root():
         }
     }
 
-# Order Service routes
-@app.get("/orders")
-async def get_orders():
-    """Get all orders"""
-    with tracer.start_as_current_span("get_orders") as span:
-        span.set_attribute("service", "order")
-        
+# Shared proxy engine for every route in the route table
+http_client = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Upstream client shared by all routes so connections are pooled"""
+    global http_client
+    if http_client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=50)
+        )
+    return http_client
+
+# Long-lived streams (routes with timeout: null) use their own pool, so open subscribers can
+# never take the connections other routes need. A stream that finds the pool full waits at
+# most STREAM_POOL_TIMEOUT seconds, then gets a 503.
+STREAM_MAX_CONNECTIONS = int(os.getenv("STREAM_MAX_CONNECTIONS", "100"))
+STREAM_POOL_TIMEOUT = float(os.getenv("STREAM_POOL_TIMEOUT", "1"))
+stream_http_client = None
+
+def upstream_client(route: Route):
+    """Return (client, timeout) for a route's upstream calls"""
+    global stream_http_client
+    if route.timeout is not None:
+        return get_http_client(), route.timeout
+    if stream_http_client is None:
+        stream_http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=STREAM_MAX_CONNECTIONS, max_keepalive_connections=10)
+        )
+    return stream_http_client, httpx.Timeout(None, connect=10.0, pool=STREAM_POOL_TIMEOUT)
+
+async def proxy_request(route: Route, params: Dict[str, str], request: Request):
+    """Call the route's upstream according to its mode"""
+    url = UPSTREAMS[route.upstream] + route.target_path(params)
+    if route.mode == "proxy":
+        return await forward_request(route, url, request)
+    
+    label = f"{route.upstream.capitalize()} service"
+    client, timeout = upstream_client(route)
+    
+    if route.mode == "health":
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{SERVICES['order']}/orders", timeout=10.0)
-                response.raise_for_status()
-                return response.json()
-        except httpx.RequestError as e:
-            logger.error(f"Error calling order service: {e}")
-            raise HTTPException(status_code=503, detail="Order service unavailable")
-        except httpx.HTTPStatusError as e:
-            logger.error(f"Order service returned error: {e}")
-            raise HTTPException(status_code=e.response.status_code, detail="Order service error")
-
-@app.post("/orders")
-async def create_order(order_data: Dict[str, Any]):
-    """Create a new order"""
-    with tracer.start_as_current_span("create_order") as span:
-        span.set_attribute("service", "order")
-        span.set_attribute("user_id", order_data.get("user_id"))
+            response = await client.get(url, timeout=timeout)
+            response.raise_for_status()
+            return JSONResponse(response.json())
+        except Exception as e:
+            logger.error("%s health check failed: %s", label, e)
+            raise HTTPException(status_code=503, detail=f"{label} unhealthy")
+    
+    with tracer.start_as_current_span(route.name) as span:
+        span.set_attribute("service", route.upstream)
+        
+        headers = {k: v for k, v in request.headers.items() if k.lower() in API_FORWARDED_HEADERS}
+        identity = client_identity(request)
+        if identity:
+            headers["x-client-id"] = identity
+        if route.compact:
+            headers["accept"] = payload_codec.accept_header()
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{SERVICES['order']}/orders",
-                    json=order_data,
-                    timeout=10.0
+            with timed_phase("upstream_wait", route.upstream):
+                response = await client.request(
+                    method=request.method,
+                    url=url,
+                    params=request.query_params,
+                    headers=headers,
+                    content=await request.body() if request.method in ["POST", "PUT", "PATCH"] else None,
+                    timeout=timeout
                 )
-                response.raise_for_status()
-                return response.json()
-        except httpx.RequestError as e:
-            logger.error(f"Error calling order service: {e}")
-            raise HTTPException(status_code=503, detail="Order service unavailable")
-        except httpx.HTTPStatusError as e:
-            logger.error(f"Order service returned error: {e}")
-            raise HTTPException(status_code=e.response.status_code, detail="Order service error")
-
-@app.get("/orders/health")
-async def order_service_health():
-    """Check order service health"""
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{SERVICES['order']}/health", timeout=5.0)
             response.raise_for_status()
-            return response.json()
-    except Exception as e:
-        logger.error(f"Order service health check failed: {e}")
-        raise HTTPException(status_code=503, detail="Order service unhealthy")
-
-# Inventory Service routes
-@app.get("/inventory")
-async def get_inventory():
-    """Get inventory"""
-    with tracer.start_as_current_span("get_inventory") as span:
-        span.set_attribute("service", "inventory")
-        
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{SERVICES['inventory']}/inventory", timeout=10.0)
-                response.raise_for_status()
-                return response.json()
+            with timed_phase("serialization", route.upstream):
+                if route.compact:
+                    compact = compact_response(request, response)
+                    if compact is not None:
+                        return compact
+                return JSONResponse(response.json())
         except httpx.RequestError as e:
-            logger.error(f"Error calling inventory service: {e}")
-            raise HTTPException(status_code=503, detail="Inventory service unavailable")
+            logger.error("Error calling %s service: %s", route.upstream, e)
+            raise HTTPException(status_code=503, detail=f"{label} unavailable")
         except httpx.HTTPStatusError as e:
-            logger.error(f"Inventory service returned error: {e}")
-            raise HTTPException(status_code=e.response.status_code, detail="Inventory service error")
+            logger.error("%s returned error: %s", label, e)
+            raise HTTPException(status_code=e.response.status_code, detail=f"{label} error")
 
-@app.get("/inventory/health")
-async def inventory_service_health():
-    """Check inventory service health"""
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{SERVICES['inventory']}/health", timeout=5.0)
-            response.raise_for_status()
-            return response.json()
-    except Exception as e:
-        logger.error(f"Inventory service health check failed: {e}")
-        raise HTTPException(status_code=503, detail="Inventory service unhealthy")
-
-# User Service routes
-@app.get("/users")
-async def get_users():
-    """Get all users"""
-    with tracer.start_as_current_span("get_users") as span:
-        span.set_attribute("service", "user")
-        
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{SERVICES['user']}/users", timeout=10.0)
-                response.raise_for_status()
-                return response.json()
-        except httpx.RequestError as e:
-            logger.error(f"Error calling user service: {e}")
-            raise HTTPException(status_code=503, detail="User service unavailable")
-        except httpx.HTTPStatusError as e:
-            logger.error(f"User service returned error: {e}")
-            raise HTTPException(status_code=e.response.status_code, detail="User service error")
+def compact_response(request: Request, response: httpx.Response):
+    """Relay a compact upstream list in the encoding the client accepts; None if the upstream sent plain JSON"""
+    upstream_type = payload_codec.media_type_of(response.headers.get("content-type", ""))
+    if upstream_type not in payload_codec.compact_types():
+        return None
+    wanted = payload_codec.negotiate(request.headers.get("accept"))
+    COMPACT_RESPONSES.labels(upstream=upstream_type, client=wanted).inc()
+    if wanted == upstream_type:
+        content = response.content
+    else:
+        document = payload_codec.decode(response.content, upstream_type)
+        if wanted == payload_codec.JSON:
+            return JSONResponse(payload_codec.expand(document), headers={"Vary": "Accept"})
+        content = payload_codec.encode(document, wanted)
+    return Response(content, media_type=wanted, headers={"Vary": "Accept"})
 
-@app.get("/users/health")
-async def user_service_health():
-    """Check user service health"""
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{SERVICES['user']}/health", timeout=5.0)
-            response.raise_for_status()
-            return response.json()
-    except Exception as e:
-        logger.error(f"User service health check failed: {e}")
-        raise HTTPException(status_code=503, detail="User service unhealthy")
-
-# Monitoring Service routes with full proxy support
-@app.api_route("/monitoring/prometheus/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
-async def prometheus_proxy(request: Request, path: str = ""):
-    """Proxy to Prometheus"""
-    prometheus_url = os.getenv("PROMETHEUS_URL", "http://monitoring-stack-kube-prom-prometheus.monitoring:9090")
-    target_url = f"{prometheus_url}/{path}"
+async def forward_request(route: Route, url: str, request: Request):
+    """Pass a request through to the upstream and relay its response"""
+    label = route.upstream.capitalize()
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+    client, timeout = upstream_client(route)
     
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            # Forward the request
-            response = await client.request(
-                method=request.method,
-                url=target_url,
-                params=request.query_params,
-                headers={k: v for k, v in request.headers.items() if k.lower() not in ['host', 'content-length']},
-                content=await request.body() if request.method in ["POST", "PUT"] else None
-            )
-            
-            return Response(
-                content=response.content,
+        if (route.cache == "query_range" and query_range_cache and request.method in ["GET", "POST"]
+                and url.endswith("/api/v1/query_range")):
+            cached = await cached_query_range(client, request, url, headers, timeout)
+            if cached is not None:
+                return cached
+        
+        upstream_request = client.build_request(
+            method=request.method,
+            url=url,
+            params=request.query_params,
+            headers=headers,
+            content=await request.body() if request.method in ["POST", "PUT"] else None,
+            timeout=timeout
+        )
+        with timed_phase("upstream_wait", route.upstream):
+            response = await client.send(upstream_request, stream=route.stream,
+                                         follow_redirects=route.follow_redirects)
+        
+        response_headers = {k: v for k, v in response.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+        if route.stream:
+            # Raw bytes keep the upstream content-encoding valid
+            return StreamingResponse(
+                response.aiter_raw(),
                 status_code=response.status_code,
-                headers=dict(response.headers)
+                headers=response_headers,
+                background=BackgroundTask(response.aclose)
             )
+        response_headers.pop("content-encoding", None)
+        return Response(
+            content=response.content,
+            status_code=response.status_code,
+            headers=response_headers
+        )
+    except httpx.PoolTimeout:
+        logger.warning("%s proxy: no free upstream connection for %s", label, route.name)
+        raise HTTPException(status_code=503, detail=f"{label} unavailable: too many open connections")
     except Exception as e:
-        logger.error(f"Prometheus proxy error: {e}")
-        raise HTTPException(status_code=503, detail=f"Prometheus unavailable: {str(e)}")
-
-@app.api_route("/monitoring/grafana/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
-async def grafana_proxy(request: Request, path: str = ""):
-    """Proxy to Grafana"""
-    grafana_url = os.getenv("GRAFANA_URL", "http://monitoring-stack-grafana.monitoring.svc.cluster.local:80")
-    target_url = f"{grafana_url}/{path}"
+        logger.error("%s proxy error: %s", label, e)
+        raise HTTPException(status_code=503, detail=f"{label} unavailable: {str(e)}")
+
+async def cached_query_range(client: httpx.AsyncClient, request: Request, target_url: str,
+                             headers: Dict[str, str], timeout: float):
+    """Serve /api/v1/query_range from the range cache; None if the request is not cacheable"""
+    params = dict(request.query_params)
+    if request.method == "POST":
+        params.update(parse_qsl((await request.body()).decode()))
+    # Fragments are always fetched as GET with query parameters
+    headers = {k: v for k, v in headers.items() if k.lower() != 'content-type'}
     
-    try:
-        async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
-            response = await client.request(
-                method=request.method,
-                url=target_url,
-                params=request.query_params,
-                headers={k: v for k, v in request.headers.items() if k.lower() not in ['host', 'content-length']},
-                content=await request.body() if request.method in ["POST", "PUT"] else None
-            )
-            
-            return Response(
-                content=response.content,
-                status_code=response.status_code,
-                headers=dict(response.headers)
-            )
-    except Exception as e:
-        logger.error(f"Grafana proxy error: {e}")
-        raise HTTPException(status_code=503, detail=f"Grafana unavailable: {str(e)}")
-
-@app.api_route("/monitoring/jaeger/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
-async def jaeger_proxy(request: Request, path: str = ""):
-    """Proxy to Jaeger"""
-    jaeger_url = os.getenv("JAEGER_URL", "http://jaeger-query.istio-system.svc.cluster.local:16686")
-    target_url = f"{jaeger_url}/{path}"
+    async def fetch(fragment_params):
+        with timed_phase("upstream_wait", "prometheus"):
+            return await client.get(target_url, params=fragment_params, headers=headers, timeout=timeout)
     
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.request(
-                method=request.method,
-                url=target_url,
-                params=request.query_params,
-                headers={k: v for k, v in request.headers.items() if k.lower() not in ['host', 'content-length']},
-                content=await request.body() if request.method in ["POST", "PUT"] else None
-            )
-            
-            return Response(
-                content=response.content,
-                status_code=response.status_code,
-                headers=dict(response.headers)
-            )
-    except Exception as e:
-        logger.error(f"Jaeger proxy error: {e}")
-        raise HTTPException(status_code=503, detail=f"Jaeger unavailable: {str(e)}")
-
-@app.api_route("/monitoring/kiali/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
-async def kiali_proxy(request: Request, path: str = ""):
-    """Proxy to Kiali"""
-    kiali_url = os.getenv("KIALI_URL", "http://kiali.istio-system.svc.cluster.local:20001")
-    target_url = f"{kiali_url}/{path}"
+        cached = await query_range_cache.query_range(params, fetch)
+    except CacheBypass as bypass:
+        return Response(
+            content=bypass.response.content,
+            status_code=bypass.response.status_code,
+            headers={k: v for k, v in bypass.response.headers.items()
+                     if k.lower() not in ['content-length', 'content-encoding']}
+        )
+    if cached is None:
+        return None
     
-    try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.request(
-                method=request.method,
-                url=target_url,
-                params=request.query_params,
-                headers={k: v for k, v in request.headers.items() if k.lower() not in ['host', 'content-length']},
-                content=await request.body() if request.method in ["POST", "PUT"] else None
-            )
-            
-            return Response(
-                content=response.content,
-                status_code=response.status_code,
-                headers=dict(response.headers)
-            )
-    except Exception as e:
-        logger.error(f"Kiali proxy error: {e}")
-        raise HTTPException(status_code=503, detail=f"Kiali unavailable: {str(e)}")
+    payload, outcome = cached
+    QUERY_CACHE_REQUESTS.labels(outcome=outcome).inc()
+    QUERY_CACHE_SAMPLES.set(query_range_cache.samples)
+    return JSONResponse(payload, headers={"X-Cache": outcome})
 
 @app.get("/monitoring/status")
 async def monitoring_status():
@@ -385,6 +527,88 @@ async def monitoring_status():
     
     return status
 
+def client_ip(request: Request) -> str:
+    """Client address as seen by the outermost trusted proxy, else the peer address"""
+    if TRUSTED_PROXY_HOPS > 0:
+        hops = [hop.strip() for header in request.headers.getlist("X-Forwarded-For")
+                for hop in header.split(",") if hop.strip()]
+        if len(hops) >= TRUSTED_PROXY_HOPS:
+            return hops[-TRUSTED_PROXY_HOPS]
+    return request.client.host if request.client else "unknown"
+
+def client_identity(request: Request) -> Optional[str]:
+    """Caller identity passed upstream as X-Client-ID (read-your-writes stickiness), if one can be established"""
+    client_id = request.headers.get("X-Client-ID")
+    if client_id:
+        return client_id
+    has_api_key = RATE_LIMIT_API_KEY_HEADER and request.headers.get(RATE_LIMIT_API_KEY_HEADER)
+    if has_api_key or TRUSTED_PROXY_HOPS > 0:
+        return rate_limit_client(request)
+    return None
+
+def rate_limit_client(request: Request) -> str:
+    """Identify the caller: authenticated API key if configured and sent, otherwise the client IP"""
+    api_key = request.headers.get(RATE_LIMIT_API_KEY_HEADER) if RATE_LIMIT_API_KEY_HEADER else None
+    if api_key:
+        return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    return "ip:" + client_ip(request)
+
+async def check_rate_limit(route: Route, request: Request):
+    """Spend one token for this client and route; None when the route is not limited"""
+    if not RATE_LIMIT_ENABLED or route.rate_limit is False:
+        return None
+    limits = route.rate_limit or {}
+    rate = float(limits.get("rate", RATE_LIMIT_RATE))
+    burst = int(limits.get("burst", RATE_LIMIT_BURST))
+    key = f"{rate_limit_client(request)}|{route.name if RATE_LIMIT_PER_ROUTE else '*'}"
+    
+    global shared_rate_limit_retry_at
+    result = None
+    if shared_rate_limit_store and time.monotonic() >= shared_rate_limit_retry_at:
+        try:
+            result = await shared_rate_limit_store.acquire(key, rate, burst)
+        except Exception as e:
+            RATE_LIMIT_BACKEND_ERRORS.inc()
+            shared_rate_limit_retry_at = time.monotonic() + RATE_LIMIT_REDIS_RETRY
+            logger.warning("Shared rate limit store unavailable, using local buckets for %ss: %s",
+                           RATE_LIMIT_REDIS_RETRY, e)
+    if result is None:
+        result = await local_rate_limit_store.acquire(key, rate, burst)
+    
+    if not result.allowed:
+        RATE_LIMITED.labels(route=route.name).inc()
+    return result, math.ceil(burst / rate)
+
+# Route table dispatch; registered last so the explicit endpoints above take precedence
+@app.api_route("/{full_path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"], include_in_schema=False)
+async def route_request(request: Request, full_path: str):
+    """Dispatch to the upstream configured in the route table"""
+    try:
+        matched = router.match(request.method, request.url.path)
+    except MethodNotAllowed as e:
+        raise HTTPException(status_code=405, detail="Method Not Allowed",
+                            headers={"Allow": ", ".join(sorted(e.allowed))})
+    if matched is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    
+    route, params = matched
+    limit = await check_rate_limit(route, request)
+    if limit:
+        result, window = limit
+        if not result.allowed:
+            raise HTTPException(status_code=429, detail="Too Many Requests", headers=result.headers(window))
+    
+    try:
+        response = await proxy_request(route, params, request)
+    except HTTPException as e:
+        if limit:
+            e.headers = {**(e.headers or {}), **result.headers(window)}
+        raise
+    if limit:
+        response.headers.update(result.headers(window))
+    return response
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Logging is configured by log_setup; uvicorn's access log is replaced by ACCESS_LOG
+    uvicorn.run(app, host="0.0.0.0", port=8000, log_config=None, access_log=False)
\ No newline at end of file
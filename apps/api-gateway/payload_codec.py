@@ -0,0 +1,88 @@
+"""
+Compact encodings for list responses, negotiated with the Accept header.
+
+    application/json               {"users": [{"id": 1, "username": ...}, ...], ...}   (default)
+    application/vnd.columnar+json  {"columns": {"users": ["id", "username", ...]},
+                                    "users": [[1, ...], ...], ...}
+    application/msgpack            the columnar document as MessagePack
+
+Columnar documents name each column once instead of repeating every key in
+every row. MessagePack is only offered when the optional msgpack package is
+installed. The same module is used by api-gateway and user-service.
+"""
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.columnar+json"
+MSGPACK = "application/msgpack"
+
+
+def compact_types():
+    """Compact media types this process can encode, most preferred first"""
+    return (MSGPACK, COLUMNAR_JSON) if msgpack is not None else (COLUMNAR_JSON,)
+
+
+def accept_header() -> str:
+    """Accept header for an upstream request that prefers compact encodings"""
+    types = compact_types()
+    return ", ".join([types[0]] + [f"{t};q=0.9" for t in types[1:]] + [f"{JSON};q=0.5"])
+
+
+def media_type_of(content_type: str) -> str:
+    return content_type.split(";")[0].strip().lower()
+
+
+def negotiate(accept: str) -> str:
+    """Pick the response media type for an Accept header.
+
+    Compact types are only chosen when listed explicitly; wildcards mean JSON.
+    """
+    quality = {}
+    for part in (accept or "").split(","):
+        fields = part.split(";")
+        media_type = fields[0].strip().lower()
+        q = 1.0
+        for param in fields[1:]:
+            name, _, value = param.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media_type in ("*/*", "application/*"):
+            media_type = JSON
+        quality[media_type] = max(q, quality.get(media_type, 0.0))
+
+    best, best_q = JSON, quality.get(JSON, 0.0)
+    for media_type in compact_types():
+        q = quality.get(media_type, 0.0)
+        if q > 0 and q >= best_q:
+            best, best_q = media_type, q
+    return best
+
+
+def encode(document: dict, media_type: str) -> bytes:
+    """Serialize a columnar document"""
+    if media_type == MSGPACK:
+        return msgpack.packb(document, use_bin_type=True)
+    return json.dumps(document, separators=(",", ":")).encode()
+
+
+def decode(body: bytes, media_type: str) -> dict:
+    """Parse a columnar document"""
+    if media_type == MSGPACK:
+        return msgpack.unpackb(body, raw=False)
+    return json.loads(body)
+
+
+def expand(document: dict) -> dict:
+    """Turn a columnar document into the plain JSON document (one object per row)"""
+    columns = document.pop("columns")
+    for key, names in columns.items():
+        document[key] = [dict(zip(names, row)) for row in document[key]]
+    return document
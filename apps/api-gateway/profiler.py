@@ -0,0 +1,94 @@
+"""
+Low-overhead sampling profiler used by the /admin/profile endpoint.
+
+A background thread walks sys._current_frames() every `interval` seconds and
+counts identical stacks, so the event loop keeps serving requests while it
+runs. Results export as collapsed stacks (flamegraph.pl / speedscope import)
+or as a speedscope JSON document.
+"""
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is already being captured"""
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample(duration: float, interval: float = 0.005) -> Counter:
+    """Sample every thread except the caller for `duration` seconds.
+
+    Returns a Counter keyed by (thread_name, frame, frame, ...) tuples, root first.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running")
+    try:
+        own_ident = threading.get_ident()
+        stacks = Counter()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(thread_names.get(ident, str(ident)))
+                stack.reverse()
+                stacks[tuple(stack)] += 1
+            time.sleep(interval)
+        return stacks
+    finally:
+        _profile_lock.release()
+
+
+def to_collapsed(stacks: Counter) -> str:
+    """Brendan Gregg's collapsed format: 'root;child;leaf count' per line"""
+    return "\n".join(f"{';'.join(stack)} {count}" for stack, count in stacks.most_common()) + "\n"
+
+
+def to_speedscope(stacks: Counter, interval: float, name: str) -> dict:
+    """Speedscope file format, one sampled profile per thread"""
+    frames = []
+    frame_index = {}
+    profiles = {}
+    for stack, count in stacks.items():
+        thread, *frame_labels = stack
+        indexes = []
+        for label in frame_labels:
+            if label not in frame_index:
+                frame_index[label] = len(frames)
+                frames.append({"name": label})
+            indexes.append(frame_index[label])
+        profile = profiles.setdefault(thread, {"samples": [], "weights": []})
+        profile["samples"].append(indexes)
+        profile["weights"].append(count * interval)
+
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "profiler.py",
+        "shared": {"frames": frames},
+        "profiles": [
+            {
+                "type": "sampled",
+                "name": thread,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(profile["weights"]),
+                "samples": profile["samples"],
+                "weights": profile["weights"],
+            }
+            for thread, profile in profiles.items()
+        ],
+    }
@@ -0,0 +1,217 @@
+"""
+Step-aligned result cache for Prometheus /api/v1/query_range.
+
+Dashboards re-run the same range query on every refresh while only the newest
+steps change. Each (query, step) entry keeps the samples of one contiguous,
+step-aligned time extent; a request is answered from that extent and only the
+missing head/tail fragments are fetched from Prometheus and merged in.
+
+Samples newer than `freshness` seconds are never stored, since Prometheus may
+still be ingesting them. Queries using `@ start()` / `@ end()` are not cached:
+their values depend on the request's own range, so fragments fetched for a
+different range would not match. Memory is bounded by a global sample budget
+with LRU eviction of whole entries.
+"""
+import re
+import math
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h|d|w|y)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800, "y": 31536000}
+_RANGE_AT_RE = re.compile(r"@\s*(?:start|end)\s*\(\s*\)")
+
+# Request parameters that do not change the result and are left out of the cache key
+_IGNORED_PARAMS = {"start", "end", "timeout"}
+
+
+class CacheBypass(Exception):
+    """Prometheus answered a fragment with something other than a successful matrix"""
+
+    def __init__(self, response):
+        super().__init__(f"Uncacheable Prometheus response ({response.status_code})")
+        self.response = response
+
+
+def parse_duration(value: str) -> float:
+    """Parse a Prometheus step: plain seconds ('15', '0.5') or a duration ('1m30s')"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts or "".join(number + unit for number, unit in parts) != value:
+        raise ValueError(f"Invalid duration: {value}")
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def parse_time(value: str) -> float:
+    """Parse a Prometheus timestamp: unix seconds or RFC 3339"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+class _Entry:
+    __slots__ = ("start", "end", "series", "samples")
+
+    def __init__(self, start: float, end: float):
+        self.start = start
+        self.end = end
+        # label-set key -> (metric dict, {timestamp_ms: [ts, value]})
+        self.series = {}
+        self.samples = 0
+
+
+class QueryRangeCache:
+    def __init__(self, max_samples: int = 500000, freshness: float = 60.0):
+        self.max_samples = max_samples
+        self.freshness = freshness
+        self.entries = OrderedDict()
+        self.samples = 0
+
+    def _parse(self, params):
+        """Return (key, start, end, step) with start/end aligned to step, or None if uncacheable"""
+        if "query" not in params or "start" not in params or "end" not in params or "step" not in params:
+            return None
+        if _RANGE_AT_RE.search(params["query"]):
+            return None
+        try:
+            step = parse_duration(params["step"])
+            start = parse_time(params["start"])
+            end = parse_time(params["end"])
+        except ValueError:
+            return None
+        if step <= 0 or end < start:
+            return None
+        key = tuple(sorted((k, v) for k, v in params.items() if k not in _IGNORED_PARAMS))
+        return key, math.floor(start / step) * step, math.floor(end / step) * step, step
+
+    async def query_range(self, params: dict, fetch):
+        """Answer a query_range request, fetching only what the cache lacks.
+
+        `fetch(params)` must return an httpx-style response for the given
+        parameters. Returns (payload, outcome) with outcome one of "hit",
+        "partial" or "miss", or None if the request cannot be cached. Raises
+        CacheBypass when Prometheus returns an error for a fragment.
+        """
+        parsed = self._parse(params)
+        if parsed is None:
+            return None
+        key, start, end, step = parsed
+
+        entry = self.entries.get(key)
+        if entry is not None and (entry.end < start - step or entry.start > end + step):
+            self._drop(key)
+            entry = None
+
+        if entry is None:
+            fragments = [(start, end)]
+        else:
+            fragments = []
+            if start < entry.start:
+                fragments.append((start, entry.start - step))
+            if end > entry.end:
+                fragments.append((entry.end + step, end))
+
+        fetched = []
+        for fragment_start, fragment_end in fragments:
+            response = await fetch({**params, "start": _format(fragment_start), "end": _format(fragment_end),
+                                    "step": _format(step)})
+            if response.status_code != 200:
+                raise CacheBypass(response)
+            payload = response.json()
+            data = payload.get("data") or {}
+            if payload.get("status") != "success" or data.get("resultType") != "matrix":
+                raise CacheBypass(response)
+            fetched.append(data["result"])
+
+        result = self._assemble(entry, fetched, start, end)
+        self._store(key, entry, fetched, start, end, step)
+
+        if not fragments:
+            outcome = "hit"
+        elif entry is None:
+            outcome = "miss"
+        else:
+            outcome = "partial"
+        return {"status": "success", "data": {"resultType": "matrix", "result": result}}, outcome
+
+    def _assemble(self, entry, fetched, start, end):
+        start_ms, end_ms = _ms(start), _ms(end)
+        merged = {}
+        if entry is not None:
+            for label_key, (metric, values) in entry.series.items():
+                points = {ts: point for ts, point in values.items() if start_ms <= ts <= end_ms}
+                if points:
+                    merged[label_key] = (metric, points)
+        for result in fetched:
+            for series in result:
+                metric = series.get("metric", {})
+                label_key = _label_key(metric)
+                _, points = merged.setdefault(label_key, (metric, {}))
+                for point in series.get("values", []):
+                    points[_ms(point[0])] = point
+        return [
+            {"metric": metric, "values": [points[ts] for ts in sorted(points)]}
+            for metric, points in merged.values()
+        ]
+
+    def _store(self, key, entry, fetched, start, end, step):
+        # Always stores a new _Entry: a request still awaiting its fragments keeps reading the
+        # entry it started with, so it must never change under it
+        stable_end = math.floor((time.time() - self.freshness) / step) * step
+        new_end = min(end, stable_end)
+        if entry is not None:
+            # The extent stays contiguous and is trimmed to the latest request window
+            new_end = max(entry.end, new_end)
+        # Also replaces whatever a concurrent request stored while we were fetching
+        self._drop(key)
+        if new_end < start:
+            return
+
+        stored = _Entry(start, new_end)
+        start_ms, end_ms = _ms(start), _ms(new_end)
+        if entry is not None:
+            for label_key, (metric, values) in entry.series.items():
+                points = {ts: point for ts, point in values.items() if start_ms <= ts <= end_ms}
+                if points:
+                    stored.series[label_key] = (metric, points)
+        for result in fetched:
+            for series in result:
+                metric = series.get("metric", {})
+                _, values = stored.series.setdefault(_label_key(metric), (metric, {}))
+                for point in series.get("values", []):
+                    ts = _ms(point[0])
+                    if start_ms <= ts <= end_ms:
+                        values[ts] = point
+        for label_key in [label_key for label_key, (_, values) in stored.series.items() if not values]:
+            del stored.series[label_key]
+        stored.samples = sum(len(values) for _, values in stored.series.values())
+
+        if stored.samples > self.max_samples:
+            return
+        self.entries[key] = stored
+        self.samples += stored.samples
+        while self.samples > self.max_samples:
+            _, evicted = self.entries.popitem(last=False)
+            self.samples -= evicted.samples
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.samples -= entry.samples
+
+
+def _label_key(metric: dict):
+    return tuple(sorted(metric.items()))
+
+
+def _ms(ts) -> int:
+    return int(round(float(ts) * 1000))
+
+
+def _format(ts: float) -> str:
+    return str(int(ts)) if float(ts).is_integer() else repr(ts)
@@ -0,0 +1,120 @@
+"""
+Per-client token-bucket rate limiting for the gateway.
+
+Each key (client identity + route) owns a bucket holding up to `burst` tokens,
+refilled at `rate` tokens per second; a request spends one token or is
+rejected. Two stores implement the same async `acquire()`:
+
+- MemoryTokenBucketStore: per-replica, O(1) per request, bounded to
+  `max_keys` buckets with least-recently-used eviction.
+- RedisTokenBucketStore: shared across replicas via an atomic Lua script;
+  needs the optional `redis` package.
+"""
+import math
+import time
+from collections import OrderedDict
+
+
+class RateLimitResult:
+    __slots__ = ("allowed", "limit", "remaining", "reset", "retry_after")
+
+    def __init__(self, allowed: bool, limit: int, remaining: int, reset: int, retry_after: int):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        # Seconds until the bucket is full again
+        self.reset = reset
+        # Seconds until the next request can succeed (0 when allowed)
+        self.retry_after = retry_after
+
+    def headers(self, window: int) -> dict:
+        """IETF RateLimit header fields (draft-ietf-httpapi-ratelimit-headers)"""
+        headers = {
+            "RateLimit-Limit": str(self.limit),
+            "RateLimit-Remaining": str(self.remaining),
+            "RateLimit-Reset": str(self.reset),
+            "RateLimit-Policy": f"{self.limit};w={window}",
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(self.retry_after)
+        return headers
+
+
+def _result(allowed: bool, tokens: float, rate: float, burst: int) -> RateLimitResult:
+    return RateLimitResult(
+        allowed=allowed,
+        limit=burst,
+        remaining=int(tokens),
+        reset=math.ceil((burst - tokens) / rate),
+        retry_after=0 if allowed else max(1, math.ceil((1 - tokens) / rate)),
+    )
+
+
+class MemoryTokenBucketStore:
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        # key -> [tokens, last refill (monotonic seconds)]
+        self.buckets = OrderedDict()
+
+    async def acquire(self, key: str, rate: float, burst: int) -> RateLimitResult:
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_keys:
+                self.buckets.popitem(last=False)
+            bucket = self.buckets[key] = [float(burst), now]
+        else:
+            self.buckets.move_to_end(key)
+            bucket[0] = min(float(burst), bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+        allowed = bucket[0] >= 1
+        if allowed:
+            bucket[0] -= 1
+        return _result(allowed, bucket[0], rate, burst)
+
+
+# KEYS[1] = bucket key; ARGV = rate, burst. Uses the Redis clock so replicas agree on refill time.
+_TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1])
+local ts = tonumber(bucket[2])
+if tokens == nil then
+    tokens = burst
+    ts = now
+end
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisTokenBucketStore:
+    def __init__(self, url: str, prefix: str = "ratelimit:", client=None, timeout: float = 0.1):
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError as e:
+                raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the 'redis' package") from e
+            # The limiter sits on every request; a slow Redis must fail fast so callers can fall back
+            client = redis.from_url(url, socket_connect_timeout=timeout, socket_timeout=timeout)
+        self.client = client
+        self.prefix = prefix
+        self.script = client.register_script(_TOKEN_BUCKET_LUA)
+
+    async def acquire(self, key: str, rate: float, burst: int) -> RateLimitResult:
+        allowed, tokens = await self.script(keys=[self.prefix + key], args=[rate, burst])
+        return _result(bool(int(allowed)), float(tokens), rate, burst)
+
+    async def close(self):
+        await self.client.aclose()
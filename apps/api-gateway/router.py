@@ -0,0 +1,171 @@
+"""
+Declarative route table and compiled prefix-tree router for the gateway.
+
+Routes are loaded from YAML (see routes.yaml) and compiled into a tree keyed by
+path segment. Matching walks one node per segment, preferring static segments
+over `{param}` segments over a trailing `{name:path}` catch-all, so lookup cost
+depends on path depth rather than on the number of routes.
+"""
+import os
+import re
+import yaml
+
+_PARAM_RE = re.compile(r"^\{(\w+)(:path)?\}$")
+
+MODES = ("json", "health", "proxy")
+
+
+class MethodNotAllowed(Exception):
+    """The path matched a route, but not for the requested method"""
+
+    def __init__(self, allowed):
+        super().__init__(f"Allowed methods: {', '.join(sorted(allowed))}")
+        self.allowed = allowed
+
+
+class Route:
+    """One upstream route.
+
+    mode: "json" parses the upstream body and re-emits it, "health" maps any
+    failure to 503, "proxy" passes the response through untouched.
+    stream: pass "proxy" responses through chunk by chunk instead of buffering.
+    cache: "query_range" serves Prometheus range queries from the range cache.
+    rate_limit: {rate, burst} overriding the gateway default, or false to exempt the route.
+    compact: "json" routes ask the upstream for a compact list encoding (see payload_codec).
+    """
+
+    __slots__ = ("name", "path", "methods", "upstream", "upstream_path", "timeout",
+                 "mode", "stream", "cache", "follow_redirects", "rate_limit", "compact")
+
+    def __init__(self, name: str, path: str, upstream: str, methods=("GET",), upstream_path: str = None,
+                 timeout: float = 10.0, mode: str = "json", stream: bool = False, cache: str = None,
+                 follow_redirects: bool = False, rate_limit=None, compact: bool = False):
+        if mode not in MODES:
+            raise ValueError(f"Route {name}: unknown mode '{mode}'")
+        self.name = name
+        self.path = path
+        self.methods = frozenset(method.upper() for method in methods)
+        self.upstream = upstream
+        self.upstream_path = upstream_path if upstream_path is not None else path
+        self.timeout = timeout
+        self.mode = mode
+        self.stream = stream
+        self.cache = cache
+        self.follow_redirects = follow_redirects
+        self.rate_limit = rate_limit
+        self.compact = compact
+
+    def target_path(self, params: dict) -> str:
+        return self.upstream_path.format(**params)
+
+
+def load_route_table(path: str, upstreams: dict):
+    """Load routes from YAML; the file's `upstreams` mapping extends/overrides `upstreams`"""
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+
+    upstreams = {**upstreams, **(config.get("upstreams") or {})}
+    routes = []
+    for spec in config.get("routes") or []:
+        route = Route(**spec)
+        if route.upstream not in upstreams:
+            raise ValueError(f"Route {route.name}: unknown upstream '{route.upstream}'")
+        routes.append(route)
+    return upstreams, routes
+
+
+class _Node:
+    __slots__ = ("static", "param", "param_name", "catch_all", "catch_all_name", "routes")
+
+    def __init__(self):
+        self.static = {}
+        self.param = None
+        self.param_name = None
+        self.catch_all = None
+        self.catch_all_name = None
+        # method -> Route
+        self.routes = {}
+
+
+class Router:
+    def __init__(self, routes=()):
+        self.root = _Node()
+        for route in routes:
+            self.add(route)
+
+    def add(self, route: Route):
+        node = self.root
+        segments = route.path.strip("/").split("/") if route.path.strip("/") else []
+        for index, segment in enumerate(segments):
+            param = _PARAM_RE.match(segment)
+            if param and param.group(2):
+                if index != len(segments) - 1:
+                    raise ValueError(f"Route {route.name}: catch-all must be the last segment")
+                if node.catch_all is None:
+                    node.catch_all = _Node()
+                    node.catch_all_name = param.group(1)
+                node = node.catch_all
+            elif param:
+                if node.param is None:
+                    node.param = _Node()
+                    node.param_name = param.group(1)
+                elif node.param_name != param.group(1):
+                    raise ValueError(f"Route {route.name}: conflicting parameter name '{param.group(1)}'")
+                node = node.param
+            else:
+                node = node.static.setdefault(segment, _Node())
+        for method in route.methods:
+            if method in node.routes:
+                raise ValueError(f"Route {route.name}: duplicate {method} {route.path}")
+            node.routes[method] = route
+
+    def match(self, method: str, path: str):
+        """Return (route, params), or None if no route matches.
+
+        Raises MethodNotAllowed if the path exists only for other methods.
+        Paths are matched exactly: a trailing slash ("/users/") is not
+        redirected to the route without it and does not match it.
+        """
+        segments = path[1:].split("/") if path != "/" else []
+        allowed = set()
+        found = self._match(self.root, segments, 0, method, {}, allowed)
+        if found is None and allowed:
+            raise MethodNotAllowed(allowed)
+        return found
+
+    def _match(self, node, segments, index, method, params, allowed):
+        if index == len(segments):
+            route = node.routes.get(method)
+            if route is not None:
+                return route, params
+            allowed.update(node.routes)
+            # A catch-all also matches an empty remainder
+            if node.catch_all is not None:
+                return self._match_catch_all(node, "", method, params, allowed)
+            return None
+
+        segment = segments[index]
+        child = node.static.get(segment)
+        if child is not None:
+            found = self._match(child, segments, index + 1, method, params, allowed)
+            if found is not None:
+                return found
+        if node.param is not None and segment:
+            found = self._match(node.param, segments, index + 1, method,
+                                {**params, node.param_name: segment}, allowed)
+            if found is not None:
+                return found
+        if node.catch_all is not None:
+            return self._match_catch_all(node, "/".join(segments[index:]), method, params, allowed)
+        return None
+
+    def _match_catch_all(self, node, rest, method, params, allowed):
+        route = node.catch_all.routes.get(method)
+        if route is None:
+            allowed.update(node.catch_all.routes)
+            return None
+        return route, {**params, node.catch_all_name: rest}
+
+
+def default_routes_file() -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "routes.yaml")
@@ -0,0 +1,7 @@
+import os
+import sys
+from pathlib import Path
+
+os.environ.setdefault("ACCESS_LOG", "false")
+os.environ.setdefault("JAEGER_ENABLED", "false")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,227 @@
+"""QueryRangeCache against a stubbed Prometheus"""
+import json
+import asyncio
+
+import pytest
+
+import query_cache
+from query_cache import QueryRangeCache, CacheBypass
+
+STEP = 10
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self.payload = payload
+        self.content = json.dumps(payload).encode()
+        self.headers = {"content-type": "application/json", "content-length": str(len(self.content))}
+
+    def json(self):
+        return self.payload
+
+
+class FakePrometheus:
+    """Answers every range with one series whose value at each step is its timestamp"""
+
+    def __init__(self):
+        self.calls = []
+        self.error = None
+
+    async def fetch(self, params):
+        start, end, step = float(params["start"]), float(params["end"]), float(params["step"])
+        self.calls.append((start, end))
+        if self.error:
+            return FakeResponse(*self.error)
+        values = []
+        ts = start
+        while ts <= end:
+            values.append([ts, str(ts)])
+            ts += step
+        return FakeResponse(200, {"status": "success", "data": {"resultType": "matrix", "result": [
+            {"metric": {"__name__": "up", "job": "api-gateway"}, "values": values}]}})
+
+
+def query(cache, prometheus, start, end, expr="up", step=STEP):
+    params = {"query": expr, "start": str(start), "end": str(end), "step": str(step)}
+    return asyncio.run(cache.query_range(params, prometheus.fetch))
+
+
+def timestamps(payload):
+    (series,) = payload["data"]["result"]
+    return [point[0] for point in series["values"]]
+
+
+@pytest.fixture
+def prometheus():
+    return FakePrometheus()
+
+
+def test_miss_fetches_the_aligned_range(prometheus):
+    cache = QueryRangeCache()
+    payload, outcome = query(cache, prometheus, 1003, 2007)
+    assert outcome == "miss"
+    assert prometheus.calls == [(1000, 2000)]
+    assert timestamps(payload) == list(range(1000, 2001, STEP))
+
+
+def test_repeated_request_is_a_hit(prometheus):
+    cache = QueryRangeCache()
+    first, _ = query(cache, prometheus, 1000, 2000)
+    second, outcome = query(cache, prometheus, 1000, 2000)
+    assert outcome == "hit"
+    assert len(prometheus.calls) == 1
+    assert second == first
+
+
+def test_window_moving_forward_fetches_only_the_tail(prometheus):
+    cache = QueryRangeCache()
+    query(cache, prometheus, 1000, 2000)
+    payload, outcome = query(cache, prometheus, 1020, 2020)
+    assert outcome == "partial"
+    assert prometheus.calls[1:] == [(2010, 2020)]
+    assert timestamps(payload) == list(range(1020, 2021, STEP))
+
+
+def test_earlier_start_fetches_only_the_head(prometheus):
+    cache = QueryRangeCache()
+    query(cache, prometheus, 1000, 2000)
+    payload, outcome = query(cache, prometheus, 900, 2000)
+    assert outcome == "partial"
+    assert prometheus.calls[1:] == [(900, 990)]
+    assert timestamps(payload) == list(range(900, 2001, STEP))
+
+
+def test_disjoint_range_replaces_the_entry(prometheus):
+    cache = QueryRangeCache()
+    query(cache, prometheus, 1000, 2000)
+    _, outcome = query(cache, prometheus, 5000, 6000)
+    assert outcome == "miss"
+    assert prometheus.calls[1:] == [(5000, 6000)]
+    assert cache.samples == 101
+
+
+def test_concurrent_hit_does_not_trim_an_entry_being_extended(prometheus):
+    cache = QueryRangeCache()
+    query(cache, prometheus, 1000, 2000)
+    release = asyncio.Event()
+    fetch = prometheus.fetch
+
+    async def slow_fetch(params):
+        await release.wait()
+        return await fetch(params)
+
+    async def run():
+        extend = asyncio.create_task(cache.query_range(
+            {"query": "up", "start": "1000", "end": "2100", "step": str(STEP)}, slow_fetch))
+        await asyncio.sleep(0)
+        # Hits the cached [1000, 2000] while the first request waits for its tail
+        narrow = await cache.query_range({"query": "up", "start": "1500", "end": "2000", "step": str(STEP)},
+                                         prometheus.fetch)
+        release.set()
+        return await extend, narrow
+
+    (extended, extend_outcome), (narrowed, narrow_outcome) = asyncio.run(run())
+    assert narrow_outcome == "hit"
+    assert timestamps(narrowed) == list(range(1500, 2001, STEP))
+    assert extend_outcome == "partial"
+    assert timestamps(extended) == list(range(1000, 2101, STEP))
+    (entry,) = cache.entries.values()
+    assert (entry.start, entry.end) == (1000, 2100)
+
+
+def test_recent_samples_are_not_stored(prometheus, monkeypatch):
+    monkeypatch.setattr(query_cache.time, "time", lambda: 10000.0)
+    cache = QueryRangeCache(freshness=60)
+    query(cache, prometheus, 9000, 10000)
+    (entry,) = cache.entries.values()
+    assert entry.end == 9940
+
+    payload, outcome = query(cache, prometheus, 9000, 10000)
+    assert outcome == "partial"
+    assert prometheus.calls[1:] == [(9950, 10000)]
+    assert timestamps(payload) == list(range(9000, 10001, STEP))
+
+
+def test_least_recently_used_entry_is_evicted(prometheus):
+    # Each query holds 101 samples; the budget fits two
+    cache = QueryRangeCache(max_samples=250)
+    query(cache, prometheus, 0, 1000, expr="a")
+    query(cache, prometheus, 0, 1000, expr="b")
+    query(cache, prometheus, 0, 1000, expr="a")
+    query(cache, prometheus, 0, 1000, expr="c")
+    assert [dict(key)["query"] for key in cache.entries] == ["a", "c"]
+    assert cache.samples == 202
+
+
+def test_entry_larger_than_the_budget_is_not_stored(prometheus):
+    cache = QueryRangeCache(max_samples=50)
+    _, outcome = query(cache, prometheus, 0, 1000)
+    assert outcome == "miss"
+    assert not cache.entries and cache.samples == 0
+
+
+def test_error_response_passes_through(prometheus):
+    cache = QueryRangeCache()
+    prometheus.error = (400, {"status": "error", "errorType": "bad_data", "error": "parse error"})
+    with pytest.raises(CacheBypass) as bypass:
+        query(cache, prometheus, 1000, 2000, expr="up{")
+    assert bypass.value.response.status_code == 400
+    assert bypass.value.response.json()["errorType"] == "bad_data"
+    assert not cache.entries
+
+
+def test_non_matrix_result_passes_through(prometheus):
+    cache = QueryRangeCache()
+    prometheus.error = (200, {"status": "success", "data": {"resultType": "vector", "result": []}})
+    with pytest.raises(CacheBypass):
+        query(cache, prometheus, 1000, 2000)
+    assert not cache.entries
+
+
+@pytest.mark.parametrize("expr", ["rate(up[5m] @ start())", "up @ end()", "sum(up @end( ))"])
+def test_range_relative_at_modifier_is_not_cached(prometheus, expr):
+    cache = QueryRangeCache()
+    assert query(cache, prometheus, 1000, 2000, expr=expr) is None
+    assert prometheus.calls == []
+
+
+def test_fixed_at_modifier_is_cached(prometheus):
+    cache = QueryRangeCache()
+    _, outcome = query(cache, prometheus, 1000, 2000, expr="up @ 1700000000")
+    assert outcome == "miss"
+
+
+@pytest.mark.parametrize("params", [
+    {"query": "up", "start": "1000", "end": "2000"},
+    {"query": "up", "start": "2000", "end": "1000", "step": "10"},
+    {"query": "up", "start": "soon", "end": "2000", "step": "10"},
+    {"query": "up", "start": "1000", "end": "2000", "step": "0"},
+])
+def test_uncacheable_requests_return_none(prometheus, params):
+    assert asyncio.run(QueryRangeCache().query_range(params, prometheus.fetch)) is None
+    assert prometheus.calls == []
+
+
+def test_parse_duration():
+    assert query_cache.parse_duration("15") == 15
+    assert query_cache.parse_duration("1m30s") == 90
+    assert query_cache.parse_duration("500ms") == 0.5
+    with pytest.raises(ValueError):
+        query_cache.parse_duration("1m30")
+
+
+def test_gateway_returns_the_bypassed_response(prometheus):
+    from starlette.requests import Request
+    import main
+
+    class Client:
+        async def get(self, url, params=None, headers=None, timeout=None):
+            return await prometheus.fetch(params)
+
+    prometheus.error = (422, {"status": "error", "errorType": "execution", "error": "too many samples"})
+    request = Request({"type": "http", "method": "GET", "path": "/api/v1/query_range", "headers": [],
+                       "query_string": b"query=up&start=1000&end=2000&step=10"})
+    response = asyncio.run(main.cached_query_range(Client(), request, "http://prometheus/api/v1/query_range", {}, 5.0))
+    assert response.status_code == 422
+    assert json.loads(response.body)["error"] == "too many samples"
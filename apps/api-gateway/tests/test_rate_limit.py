@@ -0,0 +1,179 @@
+"""Token-bucket stores, the gateway's Redis fallback and client identification"""
+import time
+import asyncio
+
+import fakeredis
+import pytest
+from starlette.requests import Request
+
+import main
+import rate_limit
+from rate_limit import MemoryTokenBucketStore, RedisTokenBucketStore
+from router import Route
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock)
+    return clock
+
+
+def acquire_all(store, key, count, rate=1.0, burst=3):
+    async def run():
+        return [await store.acquire(key, rate, burst) for _ in range(count)]
+    return asyncio.run(run())
+
+
+def test_memory_burst_then_reject(clock):
+    results = acquire_all(MemoryTokenBucketStore(), "a", 4)
+    assert [r.allowed for r in results] == [True, True, True, False]
+    assert [r.remaining for r in results] == [2, 1, 0, 0]
+    rejected = results[-1]
+    assert rejected.retry_after == 1 and rejected.reset == 3
+    assert rejected.headers(3)["Retry-After"] == "1"
+    assert "Retry-After" not in results[0].headers(3)
+
+
+def test_memory_refill_is_capped_at_burst(clock):
+    store = MemoryTokenBucketStore()
+    acquire_all(store, "a", 3, rate=2.0)
+    clock.now += 1.0
+    assert [r.allowed for r in acquire_all(store, "a", 3, rate=2.0)] == [True, True, False]
+    clock.now += 60
+    assert [r.allowed for r in acquire_all(store, "a", 4, rate=2.0)] == [True, True, True, False]
+
+
+def test_memory_keys_are_independent(clock):
+    store = MemoryTokenBucketStore()
+    acquire_all(store, "a", 3)
+    assert acquire_all(store, "b", 1)[0].allowed
+
+
+def test_memory_evicts_least_recently_used(clock):
+    store = MemoryTokenBucketStore(max_keys=2)
+    acquire_all(store, "a", 3)
+    acquire_all(store, "b", 1)
+    acquire_all(store, "a", 1)
+    acquire_all(store, "c", 1)
+    assert list(store.buckets) == ["a", "c"]
+    # "a" kept its empty bucket; an evicted key starts full again
+    assert not acquire_all(store, "a", 1)[0].allowed
+    assert acquire_all(store, "b", 1)[0].remaining == 2
+
+
+def redis_store():
+    return RedisTokenBucketStore("redis://unused", client=fakeredis.FakeAsyncRedis())
+
+
+def test_redis_burst_then_reject():
+    results = acquire_all(redis_store(), "a", 4)
+    assert [r.allowed for r in results] == [True, True, True, False]
+    assert [r.remaining for r in results] == [2, 1, 0, 0]
+
+
+def test_redis_refills_and_expires_buckets():
+    store = redis_store()
+
+    async def run():
+        for _ in range(2):
+            await store.acquire("a", 20.0, 2)
+        empty = await store.acquire("a", 20.0, 2)
+        await asyncio.sleep(0.06)
+        refilled = await store.acquire("a", 20.0, 2)
+        ttl = await store.client.ttl("ratelimit:a")
+        return empty, refilled, ttl
+
+    empty, refilled, ttl = asyncio.run(run())
+    assert not empty.allowed
+    assert refilled.allowed
+    assert 0 < ttl <= 2
+
+
+def test_redis_buckets_are_shared_between_stores():
+    client = fakeredis.FakeAsyncRedis()
+    first = RedisTokenBucketStore("redis://unused", client=client)
+    second = RedisTokenBucketStore("redis://unused", client=client)
+
+    async def run():
+        return [(await store.acquire("a", 1.0, 2)).allowed for store in (first, second, first)]
+
+    assert asyncio.run(run()) == [True, True, False]
+
+
+class FailingStore:
+    def __init__(self):
+        self.calls = 0
+
+    async def acquire(self, key, rate, burst):
+        self.calls += 1
+        raise ConnectionError("redis down")
+
+
+def request(headers=(), peer="10.0.0.9"):
+    return Request({"type": "http", "method": "GET", "path": "/users", "client": (peer, 1234),
+                    "headers": [(k.lower().encode(), v.encode()) for k, v in headers]})
+
+
+@pytest.fixture
+def gateway_limits(monkeypatch):
+    monkeypatch.setattr(main, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(main, "RATE_LIMIT_REDIS_RETRY", 5.0)
+    monkeypatch.setattr(main, "shared_rate_limit_retry_at", 0.0)
+    monkeypatch.setattr(main, "local_rate_limit_store", MemoryTokenBucketStore())
+    shared = FailingStore()
+    monkeypatch.setattr(main, "shared_rate_limit_store", shared)
+    return shared
+
+
+def test_redis_failure_falls_back_to_local_buckets_and_backs_off(gateway_limits, monkeypatch):
+    route = Route("get_users", "/users", "user", rate_limit={"rate": 1, "burst": 2})
+    now = time.monotonic()
+    monkeypatch.setattr(main.time, "monotonic", lambda: now)
+
+    def check():
+        result, window = asyncio.run(main.check_rate_limit(route, request()))
+        return result.allowed
+
+    assert [check() for _ in range(3)] == [True, True, False]
+    # Only the first request paid for the failed Redis call
+    assert gateway_limits.calls == 1
+
+    now += 5.1
+    check()
+    assert gateway_limits.calls == 2
+
+
+def test_unlimited_routes_skip_the_limiter(gateway_limits):
+    route = Route("user_changes", "/users/changes", "user", rate_limit=False)
+    assert asyncio.run(main.check_rate_limit(route, request())) is None
+    assert gateway_limits.calls == 0
+
+
+@pytest.mark.parametrize("hops, headers, expected", [
+    (0, [("X-Forwarded-For", "1.1.1.1")], "10.0.0.9"),
+    (1, [("X-Forwarded-For", "6.6.6.6, 1.1.1.1")], "1.1.1.1"),
+    (2, [("X-Forwarded-For", "6.6.6.6, 1.1.1.1, 2.2.2.2")], "1.1.1.1"),
+    (2, [("X-Forwarded-For", "6.6.6.6"), ("X-Forwarded-For", "1.1.1.1, 2.2.2.2")], "1.1.1.1"),
+    (2, [("X-Forwarded-For", "2.2.2.2")], "10.0.0.9"),
+    (1, [], "10.0.0.9"),
+])
+def test_client_ip_uses_trusted_hop(monkeypatch, hops, headers, expected):
+    monkeypatch.setattr(main, "TRUSTED_PROXY_HOPS", hops)
+    assert main.client_ip(request(headers)) == expected
+
+
+def test_rate_limit_client_prefers_configured_api_key(monkeypatch):
+    monkeypatch.setattr(main, "RATE_LIMIT_API_KEY_HEADER", "")
+    assert main.rate_limit_client(request([("X-API-Key", "secret")])) == "ip:10.0.0.9"
+    monkeypatch.setattr(main, "RATE_LIMIT_API_KEY_HEADER", "X-API-Key")
+    key = main.rate_limit_client(request([("X-API-Key", "secret")]))
+    assert key.startswith("key:") and "secret" not in key
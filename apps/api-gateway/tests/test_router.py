@@ -0,0 +1,151 @@
+"""Route table loading and prefix-tree matching"""
+import pytest
+
+from router import MethodNotAllowed, Route, Router, default_routes_file, load_route_table
+
+
+def names(router, method, path):
+    matched = router.match(method, path)
+    return None if matched is None else (matched[0].name, matched[1])
+
+
+def test_static_beats_param_beats_catch_all():
+    router = Router([
+        Route("rest", "/files/{rest:path}", "u"),
+        Route("item", "/files/{name}", "u"),
+        Route("latest", "/files/latest", "u"),
+    ])
+    assert names(router, "GET", "/files/latest") == ("latest", {})
+    assert names(router, "GET", "/files/report") == ("item", {"name": "report"})
+    assert names(router, "GET", "/files/a/b/c") == ("rest", {"rest": "a/b/c"})
+
+
+def test_static_branch_backtracks_to_param():
+    router = Router([
+        Route("settings", "/users/me/settings", "u"),
+        Route("user_orders", "/users/{id}/orders", "u"),
+        Route("fallback", "/users/{rest:path}", "u"),
+    ])
+    assert names(router, "GET", "/users/me/settings") == ("settings", {})
+    # "me" first follows the static branch, which has no "orders" child
+    assert names(router, "GET", "/users/me/orders") == ("user_orders", {"id": "me"})
+    assert names(router, "GET", "/users/me/profile") == ("fallback", {"rest": "me/profile"})
+
+
+def test_catch_all_matches_empty_remainder():
+    router = Router([Route("prometheus_proxy", "/monitoring/prometheus/{path:path}", "prometheus")])
+    assert names(router, "GET", "/monitoring/prometheus") == ("prometheus_proxy", {"path": ""})
+    assert names(router, "GET", "/monitoring/prometheus/") == ("prometheus_proxy", {"path": ""})
+    assert names(router, "GET", "/monitoring/prometheus/api/v1/query") == \
+        ("prometheus_proxy", {"path": "api/v1/query"})
+    assert router.match("GET", "/monitoring") is None
+
+
+def test_trailing_slash_does_not_match():
+    router = Router([Route("get_users", "/users", "user"), Route("get_user", "/users/{id}", "user")])
+    assert router.match("GET", "/users/") is None
+    assert router.match("GET", "/users//orders") is None
+
+
+def test_root_route():
+    router = Router([Route("index", "/", "u")])
+    assert names(router, "GET", "/") == ("index", {})
+    assert router.match("GET", "/index") is None
+
+
+def test_method_not_allowed_lists_methods_for_the_path():
+    router = Router([
+        Route("get_orders", "/orders", "order"),
+        Route("create_order", "/orders", "order", methods=["post"]),
+        Route("grafana", "/grafana/{path:path}", "grafana", methods=["GET", "PUT"]),
+    ])
+    assert names(router, "POST", "/orders") == ("create_order", {})
+    with pytest.raises(MethodNotAllowed) as excinfo:
+        router.match("DELETE", "/orders")
+    assert excinfo.value.allowed == {"GET", "POST"}
+    with pytest.raises(MethodNotAllowed) as excinfo:
+        router.match("POST", "/grafana/api/dashboards")
+    assert excinfo.value.allowed == {"GET", "PUT"}
+    assert router.match("DELETE", "/inventory") is None
+
+
+def test_method_allowed_on_a_less_specific_route_wins():
+    router = Router([
+        Route("user", "/users/{id}", "u"),
+        Route("proxy", "/users/{rest:path}", "u", methods=["DELETE"]),
+    ])
+    assert names(router, "DELETE", "/users/7") == ("proxy", {"rest": "7"})
+
+
+def test_duplicate_route_is_rejected():
+    router = Router([Route("get_orders", "/orders", "order")])
+    with pytest.raises(ValueError, match="duplicate GET /orders"):
+        router.add(Route("list_orders", "/orders/", "order"))
+
+
+def test_conflicting_parameter_names_are_rejected():
+    router = Router([Route("user", "/users/{id}", "u")])
+    router.add(Route("user_orders", "/users/{id}/orders", "u"))
+    with pytest.raises(ValueError, match="conflicting parameter name 'user_id'"):
+        router.add(Route("user_items", "/users/{user_id}/items", "u"))
+
+
+def test_catch_all_must_be_last():
+    with pytest.raises(ValueError, match="catch-all must be the last segment"):
+        Router([Route("bad", "/files/{rest:path}/meta", "u")])
+
+
+def test_target_path_substitutes_params():
+    route = Route("grafana", "/monitoring/grafana/{path:path}", "grafana", upstream_path="/{path}")
+    assert route.target_path({"path": "api/health"}) == "/api/health"
+    assert Route("get_users", "/users", "user").upstream_path == "/users"
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError, match="unknown mode 'raw'"):
+        Route("bad", "/bad", "u", mode="raw")
+
+
+def test_load_route_table_merges_upstreams(tmp_path):
+    routes_file = tmp_path / "routes.yaml"
+    routes_file.write_text(
+        "upstreams:\n"
+        "  billing: http://billing:8080\n"
+        "routes:\n"
+        "  - name: invoices\n"
+        "    path: /invoices\n"
+        "    upstream: billing\n"
+    )
+    upstreams, routes = load_route_table(str(routes_file), {"user": "http://user:8080"})
+    assert upstreams == {"user": "http://user:8080", "billing": "http://billing:8080"}
+    assert [route.name for route in routes] == ["invoices"]
+
+
+def test_load_route_table_rejects_unknown_upstream(tmp_path):
+    routes_file = tmp_path / "routes.yaml"
+    routes_file.write_text("routes:\n  - name: invoices\n    path: /invoices\n    upstream: billing\n")
+    with pytest.raises(ValueError, match="unknown upstream 'billing'"):
+        load_route_table(str(routes_file), {})
+
+
+def test_shipped_route_table():
+    upstreams = {name: f"http://{name}" for name in
+                 ("order", "inventory", "user", "prometheus", "grafana", "jaeger", "kiali")}
+    _, routes = load_route_table(default_routes_file(), upstreams)
+    router = Router(routes)
+
+    assert names(router, "GET", "/users") == ("get_users", {})
+    assert names(router, "GET", "/users/search") == ("search_users", {})
+    assert names(router, "GET", "/users/changes") == ("user_changes", {})
+    assert names(router, "POST", "/orders") == ("create_order", {})
+    assert names(router, "GET", "/orders/health")[0] == "order_service_health"
+    assert names(router, "GET", "/monitoring/prometheus/api/v1/query_range") == \
+        ("prometheus_proxy", {"path": "api/v1/query_range"})
+    assert names(router, "GET", "/monitoring/grafana") == ("grafana_proxy", {"path": ""})
+    with pytest.raises(MethodNotAllowed):
+        router.match("DELETE", "/users")
+    assert router.match("GET", "/users/") is None
+
+    changes = router.match("GET", "/users/changes")[0]
+    assert changes.timeout is None and changes.stream and changes.mode == "proxy"
+    assert router.match("GET", "/monitoring/prometheus/x")[0].cache == "query_range"
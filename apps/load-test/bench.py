@@ -0,0 +1,356 @@
+"""
+In-process benchmark for the api-gateway and user-service hot paths.
+
+Unlike the k6 scenarios in this directory, this needs no cluster: both FastAPI
+apps are imported from apps/, order/inventory/monitoring upstreams are served by
+a local stub, and user-service runs against a fake psycopg2 pool (or a real
+Postgres with --postgres). The simulated 50-150ms delay in user-service's
+GET /users is off unless --simulated-latency is given, so gateway:/users and
+user-service:/users measure the code rather than the sleep; the setting is
+recorded in the result file.
+
+Usage:
+    pip install -r apps/load-test/requirements-bench.txt
+    python apps/load-test/bench.py                       # writes bench-results/<git-sha>.json
+    python apps/load-test/bench.py --route gateway:/users --requests 2000
+    python apps/load-test/bench.py --compare bench-results/a.json bench-results/b.json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import logging
+import argparse
+import threading
+import subprocess
+import tracemalloc
+import importlib.util
+from pathlib import Path
+
+APPS_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "bench-results"
+
+# (target, path) pairs measured by default
+ROUTES = [
+    ("gateway", "/health"),
+    ("gateway", "/users"),
+    ("gateway", "/orders"),
+    ("gateway", "/inventory"),
+    ("gateway", "/monitoring/prometheus/api/v1/query?query=up"),
+    ("gateway", "/monitoring/status"),
+    ("user-service", "/users"),
+    ("user-service", "/users/1"),
+]
+
+
+# ---------------------------------------------------------------------------
+# Fake PostgreSQL driver
+# ---------------------------------------------------------------------------
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.result = []
+        self.rowcount = 0
+
+    def execute(self, query, params=None):
+        if "WHERE id = %s" in query:
+            user_id = params[0]
+            self.result = [row for row in self.rows[:1] if user_id >= 1]
+        elif query.lstrip().upper().startswith("SELECT COUNT"):
+            self.result = [(len(self.rows),)]
+        elif query.lstrip().upper().startswith("SELECT 1"):
+            self.result = [(1,)]
+        else:
+            self.result = self.rows
+        self.rowcount = len(self.result)
+
+    def fetchall(self):
+        return self.result
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def cursor(self):
+        return FakeCursor(self.rows)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class FakePool:
+    """Stands in for psycopg2.pool.ThreadedConnectionPool"""
+
+    def __init__(self, user_count):
+        self.rows = [
+            (i, f"user_{i}", f"user_{i}@example.com", f"User {i}",
+             "2024-01-01 00:00:00", "2024-01-01 00:00:00")
+            for i in range(1, user_count + 1)
+        ]
+
+    def getconn(self):
+        return FakeConnection(self.rows)
+
+    def putconn(self, conn, close=False):
+        pass
+
+    def closeall(self):
+        pass
+
+
+# ---------------------------------------------------------------------------
+# Local upstreams
+# ---------------------------------------------------------------------------
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def build_stub_upstream():
+    """Canned responses for order-service, inventory-service and the monitoring stack"""
+    from fastapi import FastAPI
+
+    stub = FastAPI()
+    orders = {"orders": [{"id": i, "user_id": i % 5 + 1, "product_id": i % 7 + 1, "quantity": 1,
+                          "status": "pending"} for i in range(1, 51)]}
+    inventory = {"inventory": [{"id": i, "name": f"product-{i}", "stock": 100} for i in range(1, 21)]}
+
+    @stub.get("/orders")
+    async def stub_orders():
+        return orders
+
+    @stub.post("/orders")
+    async def stub_create_order():
+        return {"id": 1, "status": "pending"}
+
+    @stub.get("/inventory")
+    async def stub_inventory():
+        return inventory
+
+    @stub.get("/health")
+    async def stub_health():
+        return {"status": "healthy"}
+
+    @stub.api_route("/{path:path}", methods=["GET", "POST"])
+    async def stub_monitoring(path: str):
+        return {"status": "success", "data": {"resultType": "vector", "result": []}}
+
+    return stub
+
+
+def serve_in_thread(app, port, lifespan="on"):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port,
+                                           log_level="warning", lifespan=lifespan))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+def load_app(name, directory):
+    """Import apps/<directory>/main.py under a unique module name"""
+    sys.path.insert(0, str(APPS_DIR / directory))
+    try:
+        spec = importlib.util.spec_from_file_location(name, APPS_DIR / directory / "main.py")
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.pop(0)
+    return module
+
+
+def setup(args):
+    """Start upstreams and return {target: ASGI app}"""
+    stub_port = free_port()
+    user_port = free_port()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+
+    os.environ.setdefault("JAEGER_ENABLED", "false")
+    os.environ.setdefault("ACCESS_LOG", "false")
+    os.environ["SIMULATED_LATENCY"] = "true" if args.simulated_latency else "false"
+    os.environ["ORDER_SERVICE_URL"] = stub_url
+    os.environ["INVENTORY_SERVICE_URL"] = stub_url
+    os.environ["USER_SERVICE_URL"] = f"http://127.0.0.1:{user_port}"
+    for name in ("PROMETHEUS_URL", "GRAFANA_URL", "JAEGER_URL", "KIALI_URL"):
+        os.environ[name] = stub_url
+
+    user_service = load_app("bench_user_service", "user-service")
+    if args.postgres:
+        serve_in_thread(user_service.app, user_port)
+    else:
+        user_service.db_pool = FakePool(args.users)
+        serve_in_thread(user_service.app, user_port, lifespan="off")
+
+    gateway = load_app("bench_api_gateway", "api-gateway")
+    serve_in_thread(build_stub_upstream(), stub_port, lifespan="off")
+
+    # The apps configure INFO logging; per-request client logs would dominate the output
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    return {"gateway": gateway.app, "user-service": user_service.app}
+
+
+# ---------------------------------------------------------------------------
+# Measurement
+# ---------------------------------------------------------------------------
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def measure_route(client, path, requests, concurrency, alloc_requests):
+    # Warm up caches, connection pools and lazy imports
+    for _ in range(min(20, requests)):
+        await client.get(path)
+
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            response = await client.get(path)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    # Allocation pass runs sequentially with tracemalloc so it doesn't skew latency
+    tracemalloc.start()
+    peak_bytes = 0
+    blocks_before = sys.getallocatedblocks()
+    for _ in range(alloc_requests):
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        await client.get(path)
+        _, peak = tracemalloc.get_traced_memory()
+        peak_bytes += peak - baseline
+    retained_blocks = sys.getallocatedblocks() - blocks_before
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "rps": round(requests / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "peak_alloc_bytes_per_request": int(peak_bytes / max(alloc_requests, 1)),
+        "retained_blocks_per_request": round(retained_blocks / max(alloc_requests, 1), 2),
+    }
+
+
+async def run(args):
+    import httpx
+
+    apps = setup(args)
+    routes = ROUTES
+    if args.route:
+        routes = [tuple(route.split(":", 1)) for route in args.route]
+
+    results = {}
+    for target, path in routes:
+        transport = httpx.ASGITransport(app=apps[target])
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            result = await measure_route(client, path, args.requests, args.concurrency, args.alloc_requests)
+        key = f"{target}:{path}"
+        results[key] = result
+        print(f"{key:60} {result['rps']:>10.1f} req/s  p50 {result['p50_ms']:>8.2f}ms  "
+              f"p95 {result['p95_ms']:>8.2f}ms  p99 {result['p99_ms']:>8.2f}ms  "
+              f"{result['peak_alloc_bytes_per_request']:>8} B/req")
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=APPS_DIR,
+                                       text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(old_path, new_path):
+    old = json.loads(Path(old_path).read_text())
+    new = json.loads(Path(new_path).read_text())
+    print(f"{old['revision']} -> {new['revision']}")
+    if old.get("settings") != new.get("settings"):
+        print(f"Settings differ: {old.get('settings')} -> {new.get('settings')}")
+    for key, after in new["routes"].items():
+        before = old["routes"].get(key)
+        if not before:
+            print(f"{key:60} (new)")
+            continue
+        deltas = []
+        for metric in ("rps", "p50_ms", "p99_ms", "peak_alloc_bytes_per_request"):
+            if before[metric]:
+                change = (after[metric] - before[metric]) / before[metric] * 100
+                deltas.append(f"{metric} {change:+6.1f}%")
+        print(f"{key:60} " + "  ".join(deltas))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark api-gateway and user-service in-process")
+    parser.add_argument("--route", action="append", help="target:path to run (repeatable), e.g. gateway:/users")
+    parser.add_argument("--requests", type=int, default=500, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--alloc-requests", type=int, default=50, help="requests traced for allocations")
+    parser.add_argument("--users", type=int, default=100, help="rows returned by the fake database")
+    parser.add_argument("--postgres", action="store_true", help="use DB_* env vars instead of the fake database")
+    parser.add_argument("--simulated-latency", action="store_true",
+                        help="keep the simulated delay in user-service GET /users")
+    parser.add_argument("--output", help="result file (default: bench-results/<git-sha>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="diff two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    revision = git_revision()
+    results = asyncio.run(run(args))
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{revision}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        "revision": revision,
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "settings": {"requests": args.requests, "concurrency": args.concurrency,
+                     "users": args.users, "postgres": args.postgres,
+                     "simulated_latency": args.simulated_latency},
+        "routes": results,
+    }, indent=2))
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Bytes on the wire and CPU per request for the user list encodings.
+
+Reuses bench.py's in-process setup (fake database with --users rows) and
+measures /users:
+
+- on the user-service hop, once per encoding (JSON, columnar JSON, MessagePack)
+- at the gateway edge, with the route's compact upstream encoding off and on,
+  for a JSON client and for a MessagePack client
+
+CPU is process CPU time (both apps run in this process) divided by the number
+of requests; the simulated delay in get_users is off, as in bench.py.
+
+Usage:
+    python apps/load-test/bench_payload.py
+    python apps/load-test/bench_payload.py --users 10000 --requests 50
+"""
+import sys
+import time
+import asyncio
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "user-service"))
+
+import payload_codec  # noqa: E402
+from bench import setup  # noqa: E402
+
+# (label, target, Accept header, gateway compact setting)
+CASES = [
+    ("user-service json", "user-service", payload_codec.JSON, None),
+    ("user-service columnar", "user-service", payload_codec.COLUMNAR_JSON, None),
+    ("user-service msgpack", "user-service", payload_codec.MSGPACK, None),
+    ("gateway json, compact off", "gateway", payload_codec.JSON, False),
+    ("gateway json, compact on", "gateway", payload_codec.JSON, True),
+    ("gateway msgpack, compact on", "gateway", payload_codec.MSGPACK, True),
+]
+
+
+async def measure(client, path, accept, requests):
+    response = await client.get(path, headers={"Accept": accept})
+    response.raise_for_status()
+    size = len(response.content)
+    content_type = response.headers.get("content-type", "")
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for _ in range(requests):
+        response = await client.get(path, headers={"Accept": accept})
+        response.raise_for_status()
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    return size, content_type, cpu / requests * 1000, wall / requests * 1000
+
+
+async def run(args):
+    import httpx
+
+    apps = setup(argparse.Namespace(users=args.users, postgres=False, simulated_latency=False))
+    gateway = sys.modules["bench_api_gateway"]
+    users_route = next(route for route in gateway.ROUTES if route.name == "get_users")
+
+    print(f"/users with {args.users} users, {args.requests} requests per case")
+    print(f"{'case':30} {'bytes':>10} {'CPU/req':>10} {'wall/req':>10}  content-type")
+    for label, target, accept, compact in CASES:
+        if accept == payload_codec.MSGPACK and payload_codec.msgpack is None:
+            print(f"{label:30} skipped (msgpack not installed)")
+            continue
+        if compact is not None:
+            users_route.compact = compact
+        transport = httpx.ASGITransport(app=apps[target])
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            size, content_type, cpu_ms, wall_ms = await measure(client, "/users", accept, args.requests)
+        print(f"{label:30} {size:>10} {cpu_ms:>8.2f}ms {wall_ms:>8.2f}ms  {content_type}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark user list encodings")
+    parser.add_argument("--users", type=int, default=10000, help="rows returned by the fake database")
+    parser.add_argument("--requests", type=int, default=30, help="requests per case")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Routing microbenchmark: api-gateway's compiled prefix-tree router vs. the linear
+route scan Starlette/FastAPI performs, over a generated table of a few hundred
+routes.
+
+Usage:
+    python apps/load-test/bench_router.py
+    python apps/load-test/bench_router.py --services 200 --iterations 200000
+"""
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "api-gateway"))
+
+from router import Route, Router  # noqa: E402
+
+
+def build_routes(services):
+    """Per service: a collection, an item, a nested item, a health check and a catch-all proxy"""
+    routes = []
+    for i in range(services):
+        upstream = f"svc{i}"
+        routes += [
+            Route(f"{upstream}_list", f"/{upstream}/items", upstream, methods=["GET", "POST"]),
+            Route(f"{upstream}_item", f"/{upstream}/items/{{item_id}}", upstream, methods=["GET", "PUT", "DELETE"]),
+            Route(f"{upstream}_sub", f"/{upstream}/items/{{item_id}}/history", upstream),
+            Route(f"{upstream}_health", f"/{upstream}/health", upstream, mode="health"),
+            Route(f"{upstream}_proxy", f"/{upstream}/raw/{{path:path}}", upstream, mode="proxy"),
+        ]
+    return routes
+
+
+def sample_requests(services):
+    last = services - 1
+    middle = services // 2
+    return [
+        ("first static", "GET", "/svc0/items"),
+        ("middle param", "GET", f"/svc{middle}/items/42"),
+        ("last nested", "GET", f"/svc{last}/items/42/history"),
+        ("last catch-all", "GET", f"/svc{last}/raw/api/v1/query"),
+        ("miss", "GET", "/unknown/path"),
+    ]
+
+
+def starlette_matcher(routes):
+    from starlette.routing import Match, Route as StarletteRoute
+
+    async def endpoint(request):
+        return None
+
+    table = [StarletteRoute(route.path, endpoint, methods=list(route.methods)) for route in routes]
+
+    def match(method, path):
+        scope = {"type": "http", "method": method, "path": path, "root_path": ""}
+        partial = None
+        for candidate in table:
+            result, child_scope = candidate.matches(scope)
+            if result == Match.FULL:
+                return candidate, child_scope
+            if result == Match.PARTIAL and partial is None:
+                partial = candidate
+        return partial
+
+    return match
+
+
+def time_per_call(fn, method, path, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(method, path)
+    return (time.perf_counter() - start) / iterations * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the gateway route matcher")
+    parser.add_argument("--services", type=int, default=60, help="services in the generated table (5 routes each)")
+    parser.add_argument("--iterations", type=int, default=50000)
+    args = parser.parse_args()
+
+    routes = build_routes(args.services)
+    compiled = Router(routes)
+
+    def tree_match(method, path):
+        try:
+            return compiled.match(method, path)
+        except Exception:
+            return None
+
+    try:
+        linear = starlette_matcher(routes)
+    except ImportError:
+        linear = None
+
+    print(f"{len(routes)} routes, {args.iterations} iterations per case")
+    print(f"{'case':20} {'prefix tree':>14} {'linear scan':>14}")
+    for label, method, path in sample_requests(args.services):
+        tree_ns = time_per_call(tree_match, method, path, args.iterations)
+        linear_ns = time_per_call(linear, method, path, max(args.iterations // 20, 100)) if linear else None
+        linear_text = f"{linear_ns:>11.0f} ns" if linear_ns is not None else f"{'n/a':>14}"
+        print(f"{label:20} {tree_ns:>11.0f} ns {linear_text}")
+
+
+if __name__ == "__main__":
+    main()
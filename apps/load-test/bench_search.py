@@ -0,0 +1,198 @@
+"""
+Latency benchmark for user-service's /users/search queries on a large users
+table, showing which indexes each query uses.
+
+Loads a synthetic users table (1M rows by default) into a scratch schema of
+the database named by the DB_* environment variables, creates the same search
+indexes as user-service, then for each case prints the plan's index usage and
+query latency, with and without indexes.
+
+Usage:
+    DB_HOST=localhost python apps/load-test/bench_search.py
+    DB_HOST=localhost python apps/load-test/bench_search.py --rows 100000 --iterations 50
+"""
+import os
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import psycopg2
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "user-service"))
+
+import user_search  # noqa: E402
+
+FIRST_NAMES = ["James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "William",
+               "Elizabeth", "David", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah",
+               "Charles", "Karen", "Minjun", "Seoyeon", "Jiho", "Haeun", "Doyun", "Jiwoo", "Alice", "Bob"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez",
+              "Martinez", "Hernandez", "Lopez", "Wilson", "Anderson", "Taylor", "Moore", "Kim", "Lee",
+              "Park", "Choi", "Jung", "Kang", "Cho", "Yoon", "Jang", "Lim", "Han", "Oh"]
+
+# (label, q, mode, pages to skip before the measured page)
+CASES = [
+    ("prefix username", "john_smith12", "prefix", 0),
+    ("prefix email", "mary.kim9", "prefix", 0),
+    ("prefix full_name", "jiho par", "prefix", 0),
+    ("prefix page 20", "john_smith", "prefix", 20),
+    ("fuzzy typo", "jonh smiht", "fuzzy", 0),
+    ("fuzzy page 5", "jennifer parl", "fuzzy", 5),
+]
+
+
+def connect(schema):
+    conn = psycopg2.connect(
+        host=os.getenv("DB_HOST", "postgresql"),
+        port=os.getenv("DB_PORT", "5432"),
+        database=os.getenv("DB_NAME", "postgres"),
+        user=os.getenv("DB_USER", "postgres"),
+        password=os.getenv("DB_PASSWORD", "postgres"),
+        options=f"-c search_path={schema},public",
+    )
+    return conn
+
+
+def load(conn, schema, rows, reload):
+    """Create and fill <schema>.users unless it already holds `rows` rows"""
+    cursor = conn.cursor()
+    cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (f"{schema}.users",))
+    if cursor.fetchone()[0] and not reload:
+        cursor.execute(f"SELECT COUNT(*) FROM {schema}.users")
+        if cursor.fetchone()[0] == rows:
+            conn.commit()
+            return
+    cursor.execute(f"DROP TABLE IF EXISTS {schema}.users")
+    cursor.execute(f"""
+        CREATE TABLE {schema}.users (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(100) UNIQUE NOT NULL,
+            email VARCHAR(255) UNIQUE NOT NULL,
+            full_name VARCHAR(255) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    print(f"Loading {rows} users into {schema}.users ...", flush=True)
+    start = time.perf_counter()
+    cursor.execute(f"""
+        INSERT INTO {schema}.users (username, email, full_name)
+        SELECT lower(first) || '_' || lower(last) || i,
+               lower(first) || '.' || lower(last) || i || '@example.com',
+               first || ' ' || last
+        FROM generate_series(1, %(rows)s) i,
+             LATERAL (SELECT (%(first)s::text[])[1 + i %% %(first_count)s] AS first,
+                             (%(last)s::text[])[1 + (i / %(first_count)s) %% %(last_count)s] AS last) names
+    """, {"rows": rows, "first": FIRST_NAMES, "last": LAST_NAMES,
+          "first_count": len(FIRST_NAMES), "last_count": len(LAST_NAMES)})
+    conn.commit()
+    print(f"  loaded in {time.perf_counter() - start:.1f}s")
+
+
+def create_indexes(conn):
+    """Same indexes as user-service builds at startup; returns whether fuzzy search is available"""
+    conn.autocommit = True
+    cursor = conn.cursor()
+    start = time.perf_counter()
+    for name, definition in user_search.PREFIX_INDEXES.items():
+        user_search.create_index(cursor, name, definition)
+    fuzzy = True
+    try:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for name, definition in user_search.TRIGRAM_INDEXES.items():
+            user_search.create_index(cursor, name, definition)
+    except psycopg2.Error as e:
+        fuzzy = False
+        print(f"pg_trgm unavailable, skipping fuzzy cases: {str(e).splitlines()[0]}")
+    cursor.execute("ANALYZE users")
+    conn.autocommit = False
+    print(f"  indexes ready in {time.perf_counter() - start:.1f}s")
+    return fuzzy
+
+
+def seek(conn, q, mode, limit, pages):
+    """Follow `pages` cursors and return the keyset position of the next page"""
+    cursor = conn.cursor()
+    after = None
+    for _ in range(pages):
+        _, next_cursor = user_search.search(cursor, q, mode, limit, after)
+        conn.rollback()
+        if next_cursor is None:
+            break
+        after = user_search.decode_cursor(next_cursor, mode)
+    return after
+
+
+def plan_summary(conn, q, mode, limit, after):
+    cursor = conn.cursor()
+    if mode == "fuzzy":
+        cursor.execute("SELECT set_config('pg_trgm.word_similarity_threshold', '0.5', true)")
+    sql, params = user_search.build_query(q, mode, limit, after)
+    cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql, params)
+    plan = cursor.fetchone()[0][0]["Plan"]
+    conn.rollback()
+
+    nodes, indexes = [], []
+
+    def walk(node):
+        nodes.append(node["Node Type"])
+        if "Index Name" in node:
+            indexes.append(node["Index Name"])
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(plan)
+    return indexes, nodes
+
+
+def time_query(conn, q, mode, limit, after, iterations, use_indexes=True):
+    cursor = conn.cursor()
+    latencies = []
+    for _ in range(iterations):
+        if not use_indexes:
+            cursor.execute("SET LOCAL enable_indexscan = off")
+            cursor.execute("SET LOCAL enable_bitmapscan = off")
+        start = time.perf_counter()
+        user_search.search(cursor, q, mode, limit, after)
+        latencies.append(time.perf_counter() - start)
+        conn.rollback()
+    latencies.sort()
+    return (latencies[len(latencies) // 2] * 1000,
+            latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark user search queries on a large users table")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--schema", default="bench_search", help="scratch schema for the benchmark table")
+    parser.add_argument("--reload", action="store_true", help="recreate the table even if it is already loaded")
+    parser.add_argument("--limit", type=int, default=20, help="page size")
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--no-baseline", action="store_true", help="skip the runs with index scans disabled")
+    args = parser.parse_args()
+
+    conn = connect(args.schema)
+    load(conn, args.schema, args.rows, args.reload)
+    fuzzy = create_indexes(conn)
+
+    baseline_iterations = max(args.iterations // 20, 3)
+    print(f"{args.rows} rows, page size {args.limit}, {args.iterations} iterations per case")
+    print(f"{'case':18} {'p50':>9} {'p95':>9} {'no-index p50':>13}  plan")
+    for label, q, mode, pages in CASES:
+        if mode == "fuzzy" and not fuzzy:
+            continue
+        after = seek(conn, q, mode, args.limit, pages)
+        indexes, nodes = plan_summary(conn, q, mode, args.limit, after)
+        p50, p95 = time_query(conn, q, mode, args.limit, after, args.iterations)
+        baseline = ""
+        if not args.no_baseline:
+            baseline_p50, _ = time_query(conn, q, mode, args.limit, after, baseline_iterations, use_indexes=False)
+            baseline = f"{baseline_p50:>10.2f}ms"
+        plan = ", ".join(dict.fromkeys(indexes)) or "no index"
+        print(f"{label:18} {p50:>7.2f}ms {p95:>7.2f}ms {baseline:>13}  {plan} [{' > '.join(nodes)}]")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
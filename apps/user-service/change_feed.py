@@ -0,0 +1,227 @@
+"""
+User change feed backed by PostgreSQL LISTEN/NOTIFY.
+
+A trigger on `users` appends every insert/update/delete to the `user_changes`
+table and NOTIFYs its id. One dedicated autocommit connection LISTENs on that
+channel; its socket is watched with loop.add_reader, so waiting for changes
+never blocks the event loop. Each notification triggers a single fetch of the
+new rows, which is fanned out to all subscribers.
+
+Events are stored, so a client can resume from its last event id (SSE
+Last-Event-ID) and receive what it missed from the table before switching to
+live events.
+
+Ids are assigned before commit, so a change can become visible while an
+earlier id is still committing. fetch_changes only returns changes that can no
+longer be preceded by another commit and reports when newer ones are held
+back; the feed then polls every `hold_retry` seconds until they are released,
+since the transaction they wait for may roll back and never NOTIFY.
+"""
+import json
+import asyncio
+import logging
+
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "user_changes"
+FETCH_LIMIT = 500
+
+
+class _Subscription:
+    __slots__ = ("queue",)
+
+    def __init__(self, size: int):
+        self.queue = asyncio.Queue(maxsize=size)
+
+
+class UserChangeFeed:
+    def __init__(self, db_config: dict, fetch_changes, oldest_change_id, prune_changes,
+                 queue_size: int = 1000, reconnect_delay: float = 5.0, prune_interval: float = 600.0,
+                 hold_retry: float = 0.2):
+        """
+        fetch_changes(after_id, limit) -> (event dicts ordered by id, whether newer changes are held back)
+        oldest_change_id() -> smallest id still stored, or the next id to be assigned when the
+            table is empty (everything before it was pruned)
+        prune_changes() -> delete events past retention
+        All three are blocking and run in worker threads.
+        """
+        self.db_config = db_config
+        self.fetch_changes = fetch_changes
+        self.oldest_change_id = oldest_change_id
+        self.prune_changes = prune_changes
+        self.queue_size = queue_size
+        self.reconnect_delay = reconnect_delay
+        self.prune_interval = prune_interval
+        self.hold_retry = hold_retry
+        self.retry_handle = None
+        self.subscribers = set()
+        self.last_id = 0
+        self.conn = None
+        self.loop = None
+        self.fetching = False
+        self.pending = False
+        self.tasks = set()
+        self.stopped = False
+
+    async def start(self, last_id: int):
+        self.loop = asyncio.get_running_loop()
+        self.last_id = last_id
+        await self._connect()
+        self._spawn(self._prune_loop())
+
+    async def stop(self):
+        self.stopped = True
+        if self.retry_handle is not None:
+            self.retry_handle.cancel()
+        self._disconnect()
+        for task in list(self.tasks):
+            task.cancel()
+        for subscription in list(self.subscribers):
+            self._close(subscription)
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _connect(self):
+        try:
+            self.conn = await asyncio.to_thread(psycopg2.connect, **self.db_config)
+            self.conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            cursor = self.conn.cursor()
+            cursor.execute(f"LISTEN {CHANNEL}")
+            cursor.close()
+            self.loop.add_reader(self.conn.fileno(), self._on_readable)
+            logger.info("Listening for user changes")
+            # Catch up on anything committed while we were not listening
+            self._schedule_fetch()
+        except psycopg2.Error as e:
+            logger.warning("Failed to LISTEN for user changes, retrying in %ss: %s", self.reconnect_delay, e)
+            self._disconnect()
+            self._schedule_reconnect()
+
+    def _disconnect(self):
+        if self.conn is not None:
+            try:
+                self.loop.remove_reader(self.conn.fileno())
+            except Exception:
+                pass
+            self.conn.close()
+            self.conn = None
+
+    def _schedule_reconnect(self):
+        if not self.stopped:
+            self.loop.call_later(self.reconnect_delay, lambda: self._spawn(self._connect()))
+
+    def _on_readable(self):
+        try:
+            self.conn.poll()
+        except psycopg2.Error as e:
+            logger.warning("Lost user change listener connection: %s", e)
+            self._disconnect()
+            self._schedule_reconnect()
+            return
+        if self.conn.notifies:
+            self.conn.notifies.clear()
+            self._schedule_fetch()
+
+    def _schedule_fetch(self):
+        # Notifications arriving during a fetch are coalesced into one more round
+        if self.fetching:
+            self.pending = True
+        else:
+            self.fetching = True
+            self._spawn(self._fetch_new())
+
+    async def _fetch_new(self):
+        held = False
+        try:
+            while True:
+                self.pending = False
+                events, held = await asyncio.to_thread(self.fetch_changes, self.last_id, FETCH_LIMIT)
+                for event in events:
+                    self.last_id = event["id"]
+                    self._publish(event)
+                if not self.pending and len(events) < FETCH_LIMIT:
+                    break
+        except Exception as e:
+            logger.error("Failed to fetch user changes: %s", e)
+        finally:
+            self.fetching = False
+        if held and self.retry_handle is None and not self.stopped:
+            self.retry_handle = self.loop.call_later(self.hold_retry, self._retry_held)
+
+    def _retry_held(self):
+        self.retry_handle = None
+        self._schedule_fetch()
+
+    def _publish(self, event):
+        for subscription in list(self.subscribers):
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # A slow consumer is cut off; it resumes from its cursor on reconnect
+                logger.warning("Dropping slow user change subscriber")
+                self._close(subscription)
+
+    def _close(self, subscription):
+        self.subscribers.discard(subscription)
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(None)
+
+    async def _prune_loop(self):
+        while True:
+            await asyncio.sleep(self.prune_interval)
+            try:
+                await asyncio.to_thread(self.prune_changes)
+            except Exception as e:
+                logger.warning("Failed to prune user changes: %s", e)
+
+    async def events(self, after_id=None, keepalive: float = 15.0):
+        """Yield Server-Sent Events, starting after `after_id` (or from now)"""
+        # Subscribe before reading the backlog so nothing falls in between
+        subscription = _Subscription(self.queue_size)
+        self.subscribers.add(subscription)
+        try:
+            cursor = self.last_id if after_id is None else after_id
+            if after_id is not None:
+                oldest = await asyncio.to_thread(self.oldest_change_id)
+                if after_id < oldest - 1:
+                    # Events were pruned; the client has to reload its state
+                    yield format_event(None, "reset", {"oldest_id": oldest})
+                while True:
+                    # Held-back changes arrive through the live feed once released
+                    backlog, _ = await asyncio.to_thread(self.fetch_changes, cursor, FETCH_LIMIT)
+                    for event in backlog:
+                        cursor = event["id"]
+                        yield format_event(event["id"], f"user.{event['op']}", event)
+                    if len(backlog) < FETCH_LIMIT:
+                        break
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    break
+                if event["id"] <= cursor:
+                    continue
+                cursor = event["id"]
+                yield format_event(event["id"], f"user.{event['op']}", event)
+        finally:
+            self.subscribers.discard(subscription)
+
+
+def format_event(event_id, event_type: str, data: dict) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
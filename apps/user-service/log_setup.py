@@ -0,0 +1,222 @@
+"""
+Logging setup shared by api-gateway and user-service.
+
+- Non-blocking: loggers only put records on a bounded queue (QueueHandler).
+  A QueueListener thread formats them and writes everything queued so far
+  in one write, so a slow or contended stdout never stalls the event loop.
+  Records are dropped (and counted) when the queue is full.
+- Structured: "json" emits one object per line with the service name and
+  the OpenTelemetry trace/span id active where the record was logged;
+  "text" is a plain single-line format.
+- Rate-limited: WARNING and above are limited per call site to `burst`
+  records per `window` seconds; the next record let through reports how
+  many were suppressed. Loggers in `rate_limit_exempt` (by default the loop
+  monitor, whose blocked-loop stacks all come from one call site and are
+  already reported once per stall) are never limited.
+- Access log: log_access() writes one record per request to the "access"
+  logger; uvicorn's own access log is turned off.
+"""
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from opentelemetry import trace
+
+access_logger = logging.getLogger("access")
+
+# Attributes every LogRecord has; anything else was passed with extra= and is emitted as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message", "asctime", "trace_id", "span_id", "suppressed", "dropped", "service",
+    # uvicorn's ANSI-colored copy of the message
+    "color_message"}
+
+_listener = None
+_writer = None
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through at most `burst` records per call site per `window` seconds at or above `level`"""
+
+    def __init__(self, burst: int, window: float, level: int = logging.WARNING, max_sites: int = 1000,
+                 exempt=()):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.level = level
+        self.max_sites = max_sites
+        self.exempt = frozenset(exempt)
+        self.lock = threading.Lock()
+        # (pathname, lineno) -> [window start, records let through, records suppressed]
+        self.sites = OrderedDict()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.level or self.burst <= 0 or record.name in self.exempt:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self.lock:
+            site = self.sites.get(key)
+            if site is None or now - site[0] >= self.window:
+                if site is None and len(self.sites) >= self.max_sites:
+                    self.sites.popitem(last=False)
+                if site is not None and site[2]:
+                    record.suppressed = site[2]
+                self.sites[key] = [now, 1, 0]
+                self.sites.move_to_end(key)
+                return True
+            if site[1] < self.burst:
+                site[1] += 1
+                return True
+            site[2] += 1
+            return False
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue, service: str):
+        super().__init__(log_queue)
+        self.service = service
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Resolve everything tied to the emitting thread before the record changes threads:
+        # message arguments, the traceback and the active span
+        record = super().prepare(record)
+        record.service = self.service
+        context = trace.get_current_span().get_span_context()
+        if context.is_valid:
+            record.trace_id = format(context.trace_id, "032x")
+            record.span_id = format(context.span_id, "016x")
+        return record
+
+    def enqueue(self, record):
+        if self.dropped:
+            record.dropped, self.dropped = self.dropped, 0
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _BatchingStreamHandler(logging.StreamHandler):
+    """Buffers formatted records and writes them in one call once the queue is drained"""
+
+    def __init__(self, stream, log_queue, max_batch: int = 256):
+        super().__init__(stream)
+        self.log_queue = log_queue
+        self.max_batch = max_batch
+        self.buffer = []
+
+    def emit(self, record):
+        try:
+            self.buffer.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+            return
+        if len(self.buffer) >= self.max_batch or self.log_queue.empty():
+            self._write()
+
+    def flush(self):
+        with self.lock:
+            self._write()
+            try:
+                super().flush()
+            except Exception:
+                # stdout may already be closed at interpreter exit
+                pass
+
+    def _write(self):
+        if self.buffer:
+            try:
+                self.stream.write("\n".join(self.buffer) + "\n")
+                self.stream.flush()
+            except Exception:
+                pass
+            self.buffer.clear()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "service": getattr(record, "service", None),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in ("trace_id", "span_id", "suppressed", "dropped"):
+            value = getattr(record, field, None)
+            if value:
+                entry[field] = value
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            line += f" [trace_id={trace_id}]"
+        for field in ("suppressed", "dropped"):
+            if getattr(record, field, None):
+                line += f" [{field} {getattr(record, field)} earlier records]"
+        return line
+
+
+def configure(service: str, level: str = "INFO", fmt: str = "json", burst: int = 10,
+              window: float = 60.0, queue_size: int = 10000, rate_limit_exempt=("loop_monitor",)):
+    """Route all logging through the queue; later calls in the same process are ignored"""
+    global _listener, _writer
+    if _listener is not None:
+        return
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    _writer = _BatchingStreamHandler(sys.stdout, log_queue)
+    _writer.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    _listener = logging.handlers.QueueListener(log_queue, _writer)
+    _listener.start()
+    atexit.register(shutdown)
+
+    handler = _QueueHandler(log_queue, service)
+    handler.addFilter(RateLimitFilter(burst, window, exempt=rate_limit_exempt))
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+    # uvicorn installs its own stream handlers; send its records through the queue too
+    for name in ("uvicorn", "uvicorn.error"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers.clear()
+        uvicorn_logger.propagate = True
+    logging.getLogger("uvicorn.access").disabled = True
+
+
+def shutdown():
+    """Write out whatever is still queued"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+        _writer.flush()
+
+
+def log_access(method: str, path: str, status: int, duration: float, client: str = None):
+    access_logger.info(
+        "%s %s %s %.1fms", method, path, status, duration * 1000,
+        extra={"method": method, "path": path, "status": status,
+               "duration_ms": round(duration * 1000, 3), "client": client},
+    )
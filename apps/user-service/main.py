@@ -1,14 +1,17 @@
 import os
+import hmac
 import time
+import asyncio
 import socket
 import logging
 import psycopg2
 from typing import List, Optional
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, contextmanager
 from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
 from opentelemetry import trace
 from opentelemetry.exporter.jaeger.thrift import JaegerExporter
 from opentelemetry.sdk.trace import TracerProvider
@@ -16,8 +19,22 @@ from opentelemetry.sdk.trace.export import BatchSpanProcessor
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 from opentelemetry.instrumentation.psycopg2 import Psycopg2Instrumentor
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+import profiler
+import log_setup
+import payload_codec
+from loop_monitor import LoopMonitor
+from change_feed import UserChangeFeed
+import user_search
+
+# Configure logging: records go through a queue to a background writer as JSON lines with trace ids;
+# repeated warnings/errors from the same call site are rate-limited
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_RATE_LIMIT_BURST = int(os.getenv("LOG_RATE_LIMIT_BURST", "10"))
+LOG_RATE_LIMIT_WINDOW = float(os.getenv("LOG_RATE_LIMIT_WINDOW", "60"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+ACCESS_LOG = os.getenv("ACCESS_LOG", "true").lower() == "true"
+log_setup.configure("user-service", LOG_LEVEL, LOG_FORMAT, LOG_RATE_LIMIT_BURST, LOG_RATE_LIMIT_WINDOW, LOG_QUEUE_SIZE)
 logger = logging.getLogger(__name__)
 
 # Initialize OpenTelemetry
@@ -36,7 +53,7 @@ if jaeger_enabled:
         trace.get_tracer_provider().add_span_processor(span_processor)
         logger.info("Jaeger tracing enabled")
     except Exception as e:
-        logger.warning(f"Failed to initialize Jaeger: {e}")
+        logger.warning("Failed to initialize Jaeger: %s", e)
 else:
     logger.info("Jaeger tracing disabled")
 
@@ -52,9 +69,28 @@ DB_CONFIG = {
     "password": os.getenv("DB_PASSWORD", "postgres"),
 }
 
+# Read replicas (comma-separated host[:port], same credentials as the primary)
+DB_REPLICA_HOSTS = [h.strip() for h in os.getenv("DB_REPLICA_HOSTS", "").split(",") if h.strip()]
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "5"))
+# Bounds replica connects so an unreachable replica fails fast instead of waiting on the OS TCP timeout
+DB_REPLICA_CONNECT_TIMEOUT = int(os.getenv("DB_REPLICA_CONNECT_TIMEOUT", "2"))
+# Reads from a client that just wrote stay on the primary for this many seconds
+READ_YOUR_WRITES_WINDOW = float(os.getenv("READ_YOUR_WRITES_WINDOW", "5"))
+
+# Write-behind batching for create_user (opt-in)
+USER_WRITE_BATCHING = os.getenv("USER_WRITE_BATCHING", "false").lower() == "true"
+USER_WRITE_QUEUE_SIZE = int(os.getenv("USER_WRITE_QUEUE_SIZE", "1000"))
+USER_WRITE_BATCH_SIZE = int(os.getenv("USER_WRITE_BATCH_SIZE", "50"))
+USER_WRITE_BATCH_WAIT = float(os.getenv("USER_WRITE_BATCH_WAIT_MS", "10")) / 1000
+
 # Connection pool
 from psycopg2 import pool
 db_pool = None
+replica_pools = []
+_replica_cursor = 0
+_conn_owner = {}
+_recent_writers = {}
 
 def init_db_pool():
     global db_pool
@@ -63,21 +99,103 @@ def init_db_pool():
     
     for attempt in range(max_retries):
         try:
-            db_pool = psycopg2.pool.SimpleConnectionPool(
+            db_pool = psycopg2.pool.ThreadedConnectionPool(
                 minconn=1,
                 maxconn=10,
                 **DB_CONFIG
             )
-            logger.info(f"Database connection pool established (attempt {attempt + 1})")
+            logger.info("Database connection pool established (attempt %s)", attempt + 1)
             return db_pool
         except psycopg2.OperationalError as e:
             if attempt < max_retries - 1:
-                logger.warning(f"Attempt {attempt + 1}/{max_retries}: Failed to connect to database: {e}")
+                logger.warning("Attempt %s/%s: Failed to connect to database: %s", attempt + 1, max_retries, e)
                 time.sleep(retry_delay)
             else:
-                logger.error(f"Failed to connect to database after {max_retries} attempts")
+                logger.error("Failed to connect to database after %s attempts", max_retries)
                 raise
 
+class ReplicaPool:
+    """Connection pool for one read replica plus its last observed lag.
+
+    Lag is measured by a background task (monitor); the request path only
+    reads the cached result, so a slow or unreachable replica never blocks it.
+    """
+
+    def __init__(self, address: str):
+        host, _, port = address.partition(":")
+        self.name = address
+        self.config = {**DB_CONFIG, "host": host, "port": port or DB_CONFIG["port"],
+                       "connect_timeout": DB_REPLICA_CONNECT_TIMEOUT}
+        self.pool = None
+        self.lag = None
+        self.checked_at = 0.0
+
+    def connect(self):
+        try:
+            self.pool = psycopg2.pool.ThreadedConnectionPool(minconn=1, maxconn=10, **self.config)
+            logger.info("Replica connection pool established: %s", self.name)
+        except psycopg2.OperationalError as e:
+            self.pool = None
+            logger.warning("Failed to connect to replica %s: %s", self.name, e)
+
+    def refresh_lag(self):
+        """Measure replay lag; an unreachable replica is marked unusable until the next check"""
+        self.checked_at = time.time()
+        if self.pool is None:
+            self.connect()
+            if self.pool is None:
+                self.lag = None
+                return
+        conn = None
+        try:
+            conn = self.pool.getconn()
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT CASE
+                    WHEN NOT pg_is_in_recovery() THEN 0
+                    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                END
+            """)
+            self.lag = float(cursor.fetchone()[0])
+            conn.rollback()
+            cursor.close()
+            REPLICA_LAG.labels(replica=self.name).set(self.lag)
+        except Exception as e:
+            logger.warning("Replica lag check failed for %s: %s", self.name, e)
+            self.lag = None
+            if conn:
+                self.pool.putconn(conn, close=True)
+                conn = None
+        finally:
+            if conn:
+                self.pool.putconn(conn)
+
+    async def monitor(self):
+        """Refresh lag every DB_REPLICA_CHECK_INTERVAL in a worker thread"""
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh_lag)
+            except Exception as e:
+                logger.warning("Replica monitor for %s failed: %s", self.name, e)
+            await asyncio.sleep(DB_REPLICA_CHECK_INTERVAL)
+
+    def usable(self) -> bool:
+        # A check that has not finished for several intervals (e.g. a hung connection) counts as a failure
+        fresh = time.time() - self.checked_at < DB_REPLICA_CHECK_INTERVAL * 3
+        return fresh and self.pool is not None and self.lag is not None and self.lag <= DB_REPLICA_MAX_LAG
+
+    def close(self):
+        if self.pool:
+            self.pool.closeall()
+            self.pool = None
+
+def init_replica_pools():
+    """Create replica pools; reads use the primary until a replica's first lag check succeeds"""
+    global replica_pools
+    replica_pools = [ReplicaPool(address) for address in DB_REPLICA_HOSTS]
+    return replica_pools
+
 def get_db_connection():
     global db_pool
     if db_pool is None:
@@ -86,16 +204,70 @@ def get_db_connection():
     try:
         return db_pool.getconn()
     except Exception as e:
-        logger.error(f"Failed to get connection from pool: {e}")
+        logger.error("Failed to get connection from pool: %s", e)
         # Try to reinitialize pool
         init_db_pool()
         return db_pool.getconn()
 
+def mark_client_write(client_id: Optional[str]):
+    """Pin a client's reads to the primary for READ_YOUR_WRITES_WINDOW seconds"""
+    if not client_id or not replica_pools:
+        return
+    now = time.time()
+    if len(_recent_writers) >= 10000:
+        for key in [k for k, until in _recent_writers.items() if until <= now]:
+            del _recent_writers[key]
+    _recent_writers[client_id] = now + READ_YOUR_WRITES_WINDOW
+
+def get_read_connection(client_id: Optional[str] = None):
+    """Get a connection for a read query.
+
+    Replicas are used round-robin, skipping any that are unreachable or lag
+    behind by more than DB_REPLICA_MAX_LAG. Falls back to the primary when no
+    replica qualifies or the client wrote within READ_YOUR_WRITES_WINDOW.
+    """
+    global _replica_cursor
+    if client_id and _recent_writers.get(client_id, 0) > time.time():
+        DB_READS.labels(target="primary", reason="sticky").inc()
+        return get_db_connection()
+
+    for _ in range(len(replica_pools)):
+        replica = replica_pools[_replica_cursor % len(replica_pools)]
+        _replica_cursor += 1
+        if not replica.usable():
+            continue
+        try:
+            conn = replica.pool.getconn()
+        except Exception as e:
+            logger.warning("Failed to get connection from replica %s: %s", replica.name, e)
+            replica.lag = None
+            continue
+        _conn_owner[id(conn)] = replica.pool
+        DB_READS.labels(target=replica.name, reason="replica").inc()
+        return conn
+
+    DB_READS.labels(target="primary", reason="fallback" if replica_pools else "primary").inc()
+    return get_db_connection()
+
 def return_db_connection(conn):
     global db_pool
-    if db_pool and conn:
+    if not conn:
+        return
+    owner = _conn_owner.pop(id(conn), None)
+    if owner is not None:
+        owner.putconn(conn)
+    elif db_pool:
         db_pool.putconn(conn)
 
+def client_key(request: Request) -> Optional[str]:
+    """Identify the caller for read-your-writes stickiness.
+
+    Only X-Client-ID (sent by the client or set by api-gateway) counts; the
+    peer address is the gateway or a sidecar for every caller, so keying on it
+    would pin all reads to the primary after any write.
+    """
+    return request.headers.get("X-Client-ID") or None
+
 async def init_db():
     """Initialize database and create tables"""
     conn = None
@@ -115,6 +287,58 @@ async def init_db():
             )
         """)
         
+        # Change log for the /users/changes feed, filled by a trigger so every write path is covered.
+        # Change ids can commit out of order. Before its first change a transaction takes a shared
+        # advisory lock (USER_CHANGES_LOCK_CLASS, low 32 bits of the sequence's current value); that
+        # value is below any id it will get. pg_locks shows the lock until the transaction ends, so
+        # readers only deliver ids up to the smallest such value (see settled_change_bound). Shared
+        # locks never conflict, so writers do not wait.
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS user_changes (
+                id BIGSERIAL PRIMARY KEY,
+                op VARCHAR(10) NOT NULL,
+                user_id INTEGER NOT NULL,
+                data JSONB,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute(f"""
+            CREATE OR REPLACE FUNCTION record_user_change() RETURNS trigger AS $$
+            DECLARE
+                change_id BIGINT;
+                watermark BIGINT;
+            BEGIN
+                IF current_setting('user_changes.in_flight', true) IS DISTINCT FROM 'on' THEN
+                    SELECT CASE WHEN is_called THEN last_value ELSE 0 END INTO watermark
+                    FROM user_changes_id_seq;
+                    PERFORM pg_advisory_xact_lock_shared({USER_CHANGES_LOCK_CLASS}, watermark::bit(32)::int);
+                    PERFORM set_config('user_changes.in_flight', 'on', true);
+                END IF;
+                IF TG_OP = 'DELETE' THEN
+                    INSERT INTO user_changes (op, user_id) VALUES ('delete', OLD.id)
+                    RETURNING id INTO change_id;
+                ELSE
+                    INSERT INTO user_changes (op, user_id, data) VALUES (
+                        lower(TG_OP), NEW.id,
+                        jsonb_build_object(
+                            'id', NEW.id, 'username', NEW.username, 'email', NEW.email,
+                            'full_name', NEW.full_name, 'created_at', NEW.created_at::text,
+                            'updated_at', NEW.updated_at::text
+                        )
+                    )
+                    RETURNING id INTO change_id;
+                END IF;
+                PERFORM pg_notify('user_changes', change_id::text);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+        cursor.execute("""
+            CREATE OR REPLACE TRIGGER users_change_feed
+            AFTER INSERT OR UPDATE OR DELETE ON users
+            FOR EACH ROW EXECUTE FUNCTION record_user_change()
+        """)
+        
         # Check if table is empty and insert sample data
         cursor.execute("SELECT COUNT(*) FROM users")
         count = cursor.fetchone()[0]
@@ -141,22 +365,313 @@ async def init_db():
         logger.info("Database initialized successfully")
         
     except Exception as e:
-        logger.error(f"Database initialization failed: {e}")
+        logger.error("Database initialization failed: %s", e)
         raise
     finally:
         if conn:
             return_db_connection(conn)
 
+# User search (/users/search)
+USER_SEARCH_DEFAULT_LIMIT = int(os.getenv("USER_SEARCH_DEFAULT_LIMIT", "20"))
+USER_SEARCH_MAX_LIMIT = int(os.getenv("USER_SEARCH_MAX_LIMIT", "100"))
+USER_SEARCH_FUZZY_THRESHOLD = float(os.getenv("USER_SEARCH_FUZZY_THRESHOLD", "0.5"))
+user_search_fuzzy = False
+search_index_conn = None
+
+def build_search_indexes():
+    """Build the /users/search indexes; fuzzy search is enabled once its index is valid.
+
+    Runs after init_db on its own autocommit connection: CREATE INDEX
+    CONCURRENTLY cannot run in a transaction and may take minutes on a large
+    table, during which writes continue.
+    """
+    global user_search_fuzzy, search_index_conn
+    try:
+        search_index_conn = psycopg2.connect(**DB_CONFIG)
+        search_index_conn.autocommit = True
+        cursor = search_index_conn.cursor()
+        for name, definition in user_search.PREFIX_INDEXES.items():
+            user_search.create_index(cursor, name, definition)
+        try:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            for name, definition in user_search.TRIGRAM_INDEXES.items():
+                user_search.create_index(cursor, name, definition)
+            user_search_fuzzy = True
+        except psycopg2.Error as e:
+            logger.warning("pg_trgm unavailable, fuzzy user search disabled: %s", e)
+        cursor.close()
+        logger.info("User search indexes ready")
+    except psycopg2.Error as e:
+        logger.error("Failed to build user search indexes: %s", e)
+    finally:
+        if search_index_conn is not None:
+            search_index_conn.close()
+            search_index_conn = None
+
+# Column order of user rows in compact (columnar) list responses
+USER_COLUMNS = ["id", "username", "email", "full_name", "created_at", "updated_at"]
+
+def compact_user_list(media_type: str, rows, **envelope) -> Response:
+    """User list in a negotiated compact encoding; rows are sent as-is in USER_COLUMNS order"""
+    document = {"columns": {"users": USER_COLUMNS}, "users": rows, **envelope}
+    return Response(payload_codec.encode(document, media_type), media_type=media_type,
+                    headers={"Vary": "Accept"})
+
+INSERT_USER_SQL = """
+    INSERT INTO users (username, email, full_name) 
+    VALUES (%s, %s, %s) 
+    RETURNING id, username, email, full_name, 
+              created_at::text, updated_at::text
+"""
+
+class UserWriteBatcher:
+    """Bounded queue of pending user inserts, group-committed by a background task.
+
+    A batch is flushed once USER_WRITE_BATCH_SIZE rows are waiting or
+    USER_WRITE_BATCH_WAIT has passed since the first one arrived. Each row runs
+    under its own savepoint, so a row the database rejects (duplicate
+    username/email, a value too long, ...) fails only that request while the
+    rest of the batch commits.
+    """
+
+    def __init__(self, max_queue: int, batch_size: int, max_wait: float):
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything accepted so far, then end the background task"""
+        if self.task:
+            await self.queue.put(None)
+            await self.task
+
+    async def submit(self, user_data: "CreateUserRequest"):
+        """Queue an insert and wait for its row; raises asyncio.QueueFull when saturated"""
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((user_data, future))
+        WRITE_QUEUE_DEPTH.set(self.queue.qsize())
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            WRITE_QUEUE_DEPTH.set(self.queue.qsize())
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        start_time = time.time()
+        try:
+            results = await asyncio.to_thread(self._write_batch, [user_data for user_data, _ in batch])
+        except Exception as e:
+            logger.error("User write batch of %s failed: %s", len(batch), e)
+            results = [e] * len(batch)
+        WRITE_BATCH_SIZE.observe(len(batch))
+        WRITE_FLUSH_DURATION.observe(time.time() - start_time)
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _write_batch(self, batch):
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            results = []
+            for user_data in batch:
+                cursor.execute("SAVEPOINT batch_item")
+                try:
+                    cursor.execute(INSERT_USER_SQL, (user_data.username, user_data.email, user_data.full_name))
+                    results.append(cursor.fetchone())
+                    cursor.execute("RELEASE SAVEPOINT batch_item")
+                except psycopg2.Error as e:
+                    # Any statement error (duplicate, value too long, ...) belongs to this row only;
+                    # if the connection itself is gone the rollback raises and fails the whole batch
+                    cursor.execute("ROLLBACK TO SAVEPOINT batch_item")
+                    results.append(e)
+            conn.commit()
+            cursor.close()
+            return results
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            return_db_connection(conn)
+
+write_batcher = None
+
+# User change feed (/users/changes)
+USER_CHANGES_RETENTION_HOURS = float(os.getenv("USER_CHANGES_RETENTION_HOURS", "24"))
+USER_CHANGES_KEEPALIVE = float(os.getenv("USER_CHANGES_KEEPALIVE", "15"))
+
+# Advisory lock class of in-flight user_changes writers; the two-int lock form keeps them apart
+# from every other advisory lock user of the database
+USER_CHANGES_LOCK_CLASS = 0x55434847
+
+def settled_change_bound(cursor):
+    """Highest change id that no still-running transaction can commit below.
+
+    Returns (bound, held): held is True while a writer that started before the
+    bound was read is still running. The bound must be read in its own
+    statement, before the snapshot that reads the changes.
+    """
+    # Locks carry the low 32 bits of each writer's watermark; the full value is the latest one
+    # with those bits not above the sequence, since no writer stays open across 2^32 new ids
+    cursor.execute("""
+        WITH seq AS (SELECT CASE WHEN is_called THEN last_value ELSE 0 END AS allocated FROM user_changes_id_seq)
+        SELECT seq.allocated,
+               (SELECT MIN(seq.allocated - ((seq.allocated - objid::bigint) & 4294967295)) FROM pg_locks
+                WHERE locktype = 'advisory' AND classid = %s AND objsubid = 2
+                  AND database = (SELECT oid FROM pg_database WHERE datname = current_database()))
+        FROM seq
+    """, (USER_CHANGES_LOCK_CLASS,))
+    allocated, in_flight = cursor.fetchone()
+    if in_flight is not None and in_flight < allocated:
+        return in_flight, True
+    return allocated, False
+
+def fetch_user_changes(after_id: int, limit: int):
+    """Changes after `after_id` up to settled_change_bound.
+
+    Returns (events, held): held is True when newer changes may be waiting for
+    a running transaction.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        bound, held = settled_change_bound(cursor)
+        cursor.execute("""
+            SELECT id, op, user_id, data, created_at::text
+            FROM user_changes
+            WHERE id > %s AND id <= %s
+            ORDER BY id
+            LIMIT %s
+        """, (after_id, bound, limit))
+        rows = cursor.fetchall()
+        conn.rollback()
+        cursor.close()
+        events = [
+            {"id": row[0], "op": row[1], "user_id": row[2], "user": row[3], "created_at": row[4]}
+            for row in rows
+        ]
+        return events, held
+    finally:
+        return_db_connection(conn)
+
+def oldest_user_change_id() -> int:
+    """Smallest change id still deliverable: the oldest stored, or the next to be assigned if none are"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT COALESCE(
+                (SELECT MIN(id) FROM user_changes),
+                (SELECT CASE WHEN is_called THEN last_value + 1 ELSE last_value END FROM user_changes_id_seq)
+            )
+        """)
+        oldest = cursor.fetchone()[0]
+        conn.rollback()
+        cursor.close()
+        return oldest
+    finally:
+        return_db_connection(conn)
+
+def latest_user_change_id() -> int:
+    """Last change id the live feed can start after without skipping one that is still committing"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        bound, _ = settled_change_bound(cursor)
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM user_changes WHERE id <= %s", (bound,))
+        latest = cursor.fetchone()[0]
+        conn.rollback()
+        cursor.close()
+        return latest
+    finally:
+        return_db_connection(conn)
+
+def prune_user_changes():
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM user_changes WHERE created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 hour'",
+            (USER_CHANGES_RETENTION_HOURS,)
+        )
+        conn.commit()
+        cursor.close()
+    finally:
+        return_db_connection(conn)
+
+change_feed = UserChangeFeed(DB_CONFIG, fetch_user_changes, oldest_user_change_id, prune_user_changes)
+
+# Event-loop lag monitoring; LOOP_BLOCK_DEBUG also logs the stack of any stall over the threshold
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL_MS", "100")) / 1000
+LOOP_BLOCK_DEBUG = os.getenv("LOOP_BLOCK_DEBUG", "false").lower() == "true"
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100")) / 1000
+loop_monitor = None
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    global loop_monitor
+    loop_monitor = LoopMonitor(EVENT_LOOP_LAG, EVENT_LOOP_BLOCKED, LOOP_MONITOR_INTERVAL,
+                               LOOP_BLOCK_DEBUG, LOOP_BLOCK_THRESHOLD)
+    loop_monitor.start()
     init_db_pool()
+    init_replica_pools()
+    replica_monitors = [asyncio.create_task(replica.monitor()) for replica in replica_pools]
     await init_db()
+    search_indexes = asyncio.create_task(asyncio.to_thread(build_search_indexes))
+    global write_batcher
+    if USER_WRITE_BATCHING:
+        write_batcher = UserWriteBatcher(USER_WRITE_QUEUE_SIZE, USER_WRITE_BATCH_SIZE, USER_WRITE_BATCH_WAIT)
+        write_batcher.start()
+        logger.info("User write batching enabled")
+    await change_feed.start(latest_user_change_id())
     yield
     # Shutdown
+    await change_feed.stop()
+    building = search_index_conn
+    if building is not None:
+        # Abort an unfinished index build so shutdown does not wait for it; the next start rebuilds it
+        building.cancel()
+    await asyncio.gather(search_indexes, return_exceptions=True)
+    await loop_monitor.stop()
+    for task in replica_monitors:
+        task.cancel()
+    if write_batcher:
+        await write_batcher.stop()
     global db_pool
     if db_pool:
         db_pool.closeall()
+    for replica in replica_pools:
+        replica.close()
 
 # Initialize FastAPI
 app = FastAPI(
@@ -196,6 +711,71 @@ USERS_TOTAL = Counter(
     'Total number of users created'
 )
 
+DB_READS = Counter(
+    'user_service_db_reads_total',
+    'Read queries by target database',
+    ['target', 'reason']
+)
+
+WRITE_QUEUE_DEPTH = Gauge(
+    'user_service_write_queue_depth',
+    'User inserts waiting in the write-behind queue'
+)
+
+WRITE_BATCH_SIZE = Histogram(
+    'user_service_write_batch_size',
+    'Number of user inserts per group commit',
+    buckets=[1, 2, 5, 10, 20, 50, 100, 200, 500]
+)
+
+WRITE_FLUSH_DURATION = Histogram(
+    'user_service_write_flush_duration_seconds',
+    'Time to insert and commit one write-behind batch'
+)
+
+EVENT_LOOP_LAG = Histogram(
+    'user_service_event_loop_lag_seconds',
+    'Delay between scheduled and actual wake-up of the event loop heartbeat',
+    buckets=[.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5]
+)
+
+EVENT_LOOP_BLOCKED = Counter(
+    'user_service_event_loop_blocked_total',
+    'Event loop stalls longer than LOOP_BLOCK_THRESHOLD_MS (debug mode only)'
+)
+
+PHASE_DURATION = Histogram(
+    'user_service_phase_duration_seconds',
+    'Time spent in each phase of request handling',
+    ['phase'],
+    buckets=[.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5]
+)
+
+REPLICA_LAG = Gauge(
+    'user_service_replica_lag_seconds',
+    'Last observed replication lag per read replica',
+    ['replica']
+)
+
+@contextmanager
+def timed_phase(phase: str):
+    """Record the duration of one request phase (db_checkout, query, serialization, ...)"""
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        PHASE_DURATION.labels(phase=phase).observe(time.perf_counter() - start_time)
+
+# Admin endpoints are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def require_admin(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    authorization = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(authorization, f"Bearer {ADMIN_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
 # Get pod information
 POD_NAME = os.getenv("HOSTNAME", socket.gethostname())
 POD_IP = socket.gethostbyname(socket.gethostname())
@@ -243,6 +823,10 @@ async def add_process_time_header(request: Request, call_next):
         endpoint=request.url.path
     ).observe(process_time)
     
+    if ACCESS_LOG:
+        log_setup.log_access(request.method, request.url.path, response.status_code, process_time,
+                             request.client.host if request.client else None)
+    
     return response
 
 @app.get("/health")
@@ -263,10 +847,17 @@ async def health_check():
             "pod_name": POD_NAME,
             "pod_ip": POD_IP,
             "database": "healthy",
+            "replicas": {
+                replica.name: {
+                    "status": "healthy" if replica.lag is not None else "unreachable",
+                    "lag_seconds": replica.lag
+                }
+                for replica in replica_pools
+            },
             "timestamp": time.time()
         }
     except Exception as e:
-        logger.error(f"Health check failed: {e}")
+        logger.error("Health check failed: %s", e)
         raise HTTPException(
             status_code=503,
             detail={
@@ -288,39 +879,69 @@ async def metrics():
     """Prometheus metrics endpoint"""
     return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
+@app.get("/admin/profile")
+async def admin_profile(request: Request, seconds: float = 10, interval_ms: float = 5, format: str = "collapsed"):
+    """Capture a sampling CPU profile as collapsed stacks or speedscope JSON"""
+    require_admin(request)
+    if not 0 < seconds <= 60 or not 1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="seconds must be in (0, 60] and interval_ms in [1, 1000]")
+    if format not in ("collapsed", "speedscope"):
+        raise HTTPException(status_code=400, detail="format must be 'collapsed' or 'speedscope'")
+    
+    try:
+        stacks = await asyncio.to_thread(profiler.sample, seconds, interval_ms / 1000)
+    except profiler.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    if format == "speedscope":
+        return profiler.to_speedscope(stacks, interval_ms / 1000, f"user-service {POD_NAME}")
+    return Response(profiler.to_collapsed(stacks), media_type="text/plain")
+
+# Artificial 50-150ms delay in GET /users for the demo's latency dashboards; the in-process benchmark turns it off
+SIMULATED_LATENCY = os.getenv("SIMULATED_LATENCY", "true").lower() == "true"
+
 @app.get("/users", response_model=dict)
-async def get_users():
+async def get_users(request: Request):
     """Get all users"""
     with tracer.start_as_current_span("get_users") as span:
+        conn = None
         try:
             # Simulate some processing time
-            time.sleep(0.05 + (time.time() % 0.1))
+            if SIMULATED_LATENCY:
+                time.sleep(0.05 + (time.time() % 0.1))
             
-            conn = get_db_connection()
+            with timed_phase("db_checkout"):
+                conn = get_read_connection(client_key(request))
             cursor = conn.cursor()
             
-            cursor.execute("""
-                SELECT id, username, email, full_name, 
-                       created_at::text, updated_at::text 
-                FROM users 
-                ORDER BY created_at DESC
-            """)
-            
-            rows = cursor.fetchall()
+            with timed_phase("query"):
+                cursor.execute("""
+                    SELECT id, username, email, full_name, 
+                           created_at::text, updated_at::text 
+                    FROM users 
+                    ORDER BY created_at DESC
+                """)
+                
+                rows = cursor.fetchall()
             cursor.close()
+            span.set_attribute("user_count", len(rows))
             
-            users = []
-            for row in rows:
-                users.append({
-                    "id": row[0],
-                    "username": row[1],
-                    "email": row[2],
-                    "full_name": row[3],
-                    "created_at": row[4],
-                    "updated_at": row[5]
-                })
+            media_type = payload_codec.negotiate(request.headers.get("accept"))
+            if media_type != payload_codec.JSON:
+                with timed_phase("serialization"):
+                    return compact_user_list(media_type, rows, count=len(rows), pod_name=POD_NAME, version=VERSION)
             
-            span.set_attribute("user_count", len(users))
+            with timed_phase("serialization"):
+                users = []
+                for row in rows:
+                    users.append({
+                        "id": row[0],
+                        "username": row[1],
+                        "email": row[2],
+                        "full_name": row[3],
+                        "created_at": row[4],
+                        "updated_at": row[5]
+                    })
             
             return {
                 "users": users,
@@ -330,27 +951,124 @@ async def get_users():
             }
             
         except Exception as e:
-            logger.error(f"Failed to fetch users: {e}")
+            logger.error("Failed to fetch users: %s", e)
             raise HTTPException(status_code=500, detail="Failed to fetch users")
+        finally:
+            return_db_connection(conn)
+
+@app.get("/users/search", response_model=dict)
+async def search_users(request: Request, q: str, mode: str = "prefix", limit: Optional[int] = None,
+                       cursor: Optional[str] = None):
+    """Search users by username, email or full name.
+
+    mode=prefix matches the start of any of the three fields, mode=fuzzy ranks
+    by trigram similarity. Pass next_cursor back as cursor for the next page.
+    """
+    q = q.strip()
+    limit = USER_SEARCH_DEFAULT_LIMIT if limit is None else limit
+    if mode not in user_search.MODES:
+        raise HTTPException(status_code=400, detail="mode must be 'prefix' or 'fuzzy'")
+    if not user_search.MIN_QUERY_LENGTH[mode] <= len(q) <= user_search.MAX_QUERY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"q must be {user_search.MIN_QUERY_LENGTH[mode]}"
+                                                    f"-{user_search.MAX_QUERY_LENGTH} characters for {mode} search")
+    if not 1 <= limit <= USER_SEARCH_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be in [1, {USER_SEARCH_MAX_LIMIT}]")
+    if mode == "fuzzy" and not user_search_fuzzy:
+        raise HTTPException(status_code=503, detail="Fuzzy search unavailable")
+    try:
+        after = user_search.decode_cursor(cursor, mode) if cursor else None
+    except user_search.InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    with tracer.start_as_current_span("search_users") as span:
+        span.set_attribute("search_mode", mode)
+        
+        conn = None
+        try:
+            with timed_phase("db_checkout"):
+                conn = get_read_connection(client_key(request))
+            db_cursor = conn.cursor()
+            
+            with timed_phase("query"):
+                rows, next_cursor = user_search.search(db_cursor, q, mode, limit, after,
+                                                       USER_SEARCH_FUZZY_THRESHOLD)
+            db_cursor.close()
+            span.set_attribute("user_count", len(rows))
+            
+            media_type = payload_codec.negotiate(request.headers.get("accept"))
+            if media_type != payload_codec.JSON:
+                with timed_phase("serialization"):
+                    return compact_user_list(media_type, rows, count=len(rows), next_cursor=next_cursor,
+                                             pod_name=POD_NAME, version=VERSION)
+            
+            with timed_phase("serialization"):
+                users = [
+                    {
+                        "id": row[0],
+                        "username": row[1],
+                        "email": row[2],
+                        "full_name": row[3],
+                        "created_at": row[4],
+                        "updated_at": row[5]
+                    }
+                    for row in rows
+                ]
+            
+            return {
+                "users": users,
+                "count": len(users),
+                "next_cursor": next_cursor,
+                "pod_name": POD_NAME,
+                "version": VERSION
+            }
+            
+        except Exception as e:
+            logger.error("Failed to search users: %s", e)
+            raise HTTPException(status_code=500, detail="Failed to search users")
+        finally:
+            return_db_connection(conn)
+
+@app.get("/users/changes")
+async def user_changes(request: Request, since: Optional[int] = None):
+    """Stream user changes as Server-Sent Events.
+
+    Resumes after the Last-Event-ID header (or ?since=); without either only
+    new changes are sent.
+    """
+    last_event_id = request.headers.get("Last-Event-ID")
+    if last_event_id is not None:
+        try:
+            since = int(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+    
+    return StreamingResponse(
+        change_feed.events(since, keepalive=USER_CHANGES_KEEPALIVE),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.get("/users/{user_id}", response_model=dict)
-async def get_user(user_id: int):
+async def get_user(user_id: int, request: Request):
     """Get user by ID"""
     with tracer.start_as_current_span("get_user") as span:
         span.set_attribute("user_id", user_id)
         
+        conn = None
         try:
-            conn = get_db_connection()
+            with timed_phase("db_checkout"):
+                conn = get_read_connection(client_key(request))
             cursor = conn.cursor()
             
-            cursor.execute("""
-                SELECT id, username, email, full_name, 
-                       created_at::text, updated_at::text 
-                FROM users 
-                WHERE id = %s
-            """, (user_id,))
-            
-            row = cursor.fetchone()
+            with timed_phase("query"):
+                cursor.execute("""
+                    SELECT id, username, email, full_name, 
+                           created_at::text, updated_at::text 
+                    FROM users 
+                    WHERE id = %s
+                """, (user_id,))
+                
+                row = cursor.fetchone()
             cursor.close()
             
             if not row:
@@ -374,29 +1092,34 @@ async def get_user(user_id: int):
         except HTTPException:
             raise
         except Exception as e:
-            logger.error(f"Failed to fetch user {user_id}: {e}")
+            logger.error("Failed to fetch user %s: %s", user_id, e)
             raise HTTPException(status_code=500, detail="Failed to fetch user")
+        finally:
+            return_db_connection(conn)
 
 @app.post("/users", response_model=dict)
-async def create_user(user_data: CreateUserRequest):
+async def create_user(user_data: CreateUserRequest, request: Request):
     """Create a new user"""
     with tracer.start_as_current_span("create_user") as span:
         span.set_attribute("username", user_data.username)
         
+        conn = None
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                INSERT INTO users (username, email, full_name) 
-                VALUES (%s, %s, %s) 
-                RETURNING id, username, email, full_name, 
-                          created_at::text, updated_at::text
-            """, (user_data.username, user_data.email, user_data.full_name))
-            
-            row = cursor.fetchone()
-            conn.commit()
-            cursor.close()
+            if write_batcher:
+                with timed_phase("write_queue"):
+                    row = await write_batcher.submit(user_data)
+            else:
+                with timed_phase("db_checkout"):
+                    conn = get_db_connection()
+                cursor = conn.cursor()
+                
+                with timed_phase("query"):
+                    cursor.execute(INSERT_USER_SQL, (user_data.username, user_data.email, user_data.full_name))
+                    
+                    row = cursor.fetchone()
+                    conn.commit()
+                cursor.close()
+            mark_client_write(client_key(request))
             
             # Increment users created metric
             USERS_TOTAL.inc()
@@ -417,8 +1140,11 @@ async def create_user(user_data: CreateUserRequest):
                 "version": VERSION
             }
             
+        except asyncio.QueueFull:
+            raise HTTPException(status_code=503, detail="User write queue is full")
         except psycopg2.IntegrityError as e:
-            conn.rollback()
+            if conn:
+                conn.rollback()
             if "username" in str(e):
                 raise HTTPException(status_code=400, detail="Username already exists")
             elif "email" in str(e):
@@ -426,15 +1152,18 @@ async def create_user(user_data: CreateUserRequest):
             else:
                 raise HTTPException(status_code=400, detail="User creation failed")
         except Exception as e:
-            logger.error(f"Failed to create user: {e}")
+            logger.error("Failed to create user: %s", e)
             raise HTTPException(status_code=500, detail="Failed to create user")
+        finally:
+            return_db_connection(conn)
 
 @app.put("/users/{user_id}", response_model=dict)
-async def update_user(user_id: int, user_data: UpdateUserRequest):
+async def update_user(user_id: int, user_data: UpdateUserRequest, request: Request):
     """Update user"""
     with tracer.start_as_current_span("update_user") as span:
         span.set_attribute("user_id", user_id)
         
+        conn = None
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
@@ -473,6 +1202,7 @@ async def update_user(user_id: int, user_data: UpdateUserRequest):
             
             conn.commit()
             cursor.close()
+            mark_client_write(client_key(request))
             
             user = {
                 "id": row[0],
@@ -499,15 +1229,18 @@ async def update_user(user_id: int, user_data: UpdateUserRequest):
             else:
                 raise HTTPException(status_code=400, detail="User update failed")
         except Exception as e:
-            logger.error(f"Failed to update user {user_id}: {e}")
+            logger.error("Failed to update user %s: %s", user_id, e)
             raise HTTPException(status_code=500, detail="Failed to update user")
+        finally:
+            return_db_connection(conn)
 
 @app.delete("/users/{user_id}")
-async def delete_user(user_id: int):
+async def delete_user(user_id: int, request: Request):
     """Delete user"""
     with tracer.start_as_current_span("delete_user") as span:
         span.set_attribute("user_id", user_id)
         
+        conn = None
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
@@ -519,6 +1252,7 @@ async def delete_user(user_id: int):
             
             conn.commit()
             cursor.close()
+            mark_client_write(client_key(request))
             
             return {
                 "message": "User deleted successfully",
@@ -529,9 +1263,12 @@ async def delete_user(user_id: int):
         except HTTPException:
             raise
         except Exception as e:
-            logger.error(f"Failed to delete user {user_id}: {e}")
+            logger.error("Failed to delete user %s: %s", user_id, e)
             raise HTTPException(status_code=500, detail="Failed to delete user")
+        finally:
+            return_db_connection(conn)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Logging is configured by log_setup; uvicorn's access log is replaced by ACCESS_LOG
+    uvicorn.run(app, host="0.0.0.0", port=8000, log_config=None, access_log=False)
\ No newline at end of file
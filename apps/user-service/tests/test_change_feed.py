@@ -0,0 +1,185 @@
+"""UserChangeFeed event delivery, with fake fetch_changes instead of PostgreSQL"""
+import json
+import asyncio
+
+from change_feed import UserChangeFeed
+
+
+def change(change_id, op="insert"):
+    return {"id": change_id, "op": op, "user_id": change_id, "user": None, "created_at": "2024-01-01"}
+
+
+class FakeChanges:
+    def __init__(self, ids=(), oldest=1):
+        self.rows = [change(i) for i in ids]
+        self.oldest = oldest
+        self.held = False
+        self.calls = []
+        self.on_fetch = None
+
+    def fetch(self, after_id, limit):
+        self.calls.append(after_id)
+        if self.on_fetch:
+            self.on_fetch()
+        return [row for row in self.rows if row["id"] > after_id][:limit], self.held
+
+    def oldest_change_id(self):
+        return self.oldest
+
+
+def make_feed(changes, **kwargs):
+    return UserChangeFeed({}, changes.fetch, changes.oldest_change_id, lambda: None, **kwargs)
+
+
+def parse(chunk):
+    fields = dict(line.split(": ", 1) for line in chunk.strip().split("\n"))
+    return fields.get("id"), fields["event"], json.loads(fields["data"])
+
+
+async def take(stream, count):
+    events = []
+    while len(events) < count:
+        chunk = await asyncio.wait_for(stream.__anext__(), 1)
+        if not chunk.startswith(":"):
+            events.append(parse(chunk))
+    return events
+
+
+def test_backlog_then_live_events():
+    changes = FakeChanges(ids=[1, 2, 3])
+    feed = make_feed(changes)
+
+    async def run():
+        stream = feed.events(after_id=1)
+        backlog = await take(stream, 2)
+        feed._publish(change(4, "update"))
+        live = await take(stream, 1)
+        await stream.aclose()
+        return backlog, live
+
+    backlog, live = asyncio.run(run())
+    assert [(event_id, kind) for event_id, kind, _ in backlog] == [("2", "user.insert"), ("3", "user.insert")]
+    assert [(event_id, kind) for event_id, kind, _ in live] == [("4", "user.update")]
+    assert not feed.subscribers
+
+
+def test_events_published_during_backlog_are_delivered_once():
+    changes = FakeChanges(ids=[1, 2, 3])
+    feed = make_feed(changes)
+
+    def publish_live():
+        # The live feed publishes 3 and 4 while the backlog (which already holds 3) is being read
+        if len(changes.calls) == 1:
+            for change_id in (3, 4):
+                feed._publish(change(change_id))
+
+    changes.on_fetch = publish_live
+
+    async def run():
+        stream = feed.events(after_id=0)
+        events = await take(stream, 4)
+        await stream.aclose()
+        return events
+
+    assert [event_id for event_id, _, _ in asyncio.run(run())] == ["1", "2", "3", "4"]
+
+
+def test_stale_live_events_are_skipped():
+    feed = make_feed(FakeChanges())
+    feed.last_id = 10
+
+    async def run():
+        stream = feed.events()
+        first = asyncio.ensure_future(take(stream, 1))
+        await asyncio.sleep(0.01)
+        for change_id in (9, 10, 11):
+            feed._publish(change(change_id))
+        events = await first
+        await stream.aclose()
+        return events
+
+    assert [event_id for event_id, _, _ in asyncio.run(run())] == ["11"]
+
+
+def test_without_cursor_the_backlog_is_not_read():
+    changes = FakeChanges(ids=[1, 2])
+    feed = make_feed(changes)
+
+    async def run():
+        stream = feed.events(keepalive=0.01)
+        assert await stream.__anext__() == ": keepalive\n\n"
+        await stream.aclose()
+
+    asyncio.run(run())
+    assert changes.calls == []
+
+
+def test_cursor_behind_pruned_events_gets_reset():
+    changes = FakeChanges(ids=[10, 11], oldest=10)
+    feed = make_feed(changes)
+
+    async def run():
+        stream = feed.events(after_id=5)
+        events = await take(stream, 3)
+        await stream.aclose()
+        return events
+
+    reset, first, second = asyncio.run(run())
+    assert reset == (None, "reset", {"oldest_id": 10})
+    assert (first[0], second[0]) == ("10", "11")
+
+
+def test_cursor_at_oldest_gets_no_reset():
+    changes = FakeChanges(ids=[10], oldest=10)
+    feed = make_feed(changes)
+
+    async def run():
+        stream = feed.events(after_id=9)
+        events = await take(stream, 1)
+        await stream.aclose()
+        return events
+
+    assert [kind for _, kind, _ in asyncio.run(run())] == ["user.insert"]
+
+
+def test_slow_subscriber_is_cut_off():
+    feed = make_feed(FakeChanges(), queue_size=2)
+
+    async def run():
+        stream = feed.events()
+        first = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0.01)
+        for change_id in (1, 2, 3):
+            feed._publish(change(change_id))
+        try:
+            await asyncio.wait_for(first, 1)
+        except StopAsyncIteration:
+            return True
+        return False
+
+    assert asyncio.run(run())
+    assert not feed.subscribers
+
+
+def test_held_changes_are_fetched_again():
+    changes = FakeChanges(ids=[1, 2])
+    changes.held = True
+    feed = make_feed(changes, hold_retry=0.01)
+
+    async def run():
+        feed.loop = asyncio.get_running_loop()
+        stream = feed.events()
+        first = asyncio.ensure_future(take(stream, 3))
+        await asyncio.sleep(0.01)
+        feed._schedule_fetch()
+        await asyncio.sleep(0.005)
+        # The writer that held back change 3 ends without a NOTIFY; the retry picks the change up
+        changes.rows.append(change(3))
+        changes.held = False
+        events = await first
+        await stream.aclose()
+        await feed.stop()
+        return events
+
+    assert [event_id for event_id, _, _ in asyncio.run(run())] == ["1", "2", "3"]
+    assert len(changes.calls) >= 2
@@ -0,0 +1,193 @@
+"""Read routing across replicas, using fake pools instead of PostgreSQL"""
+import time
+import asyncio
+import threading
+
+import pytest
+
+import main
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query, params=None):
+        if self.conn.pool.error:
+            raise self.conn.pool.error
+
+    def fetchone(self):
+        return (self.conn.pool.lag,)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        pass
+
+
+class FakePool:
+    def __init__(self, lag=0.0, error=None):
+        self.lag = lag
+        self.error = error
+        self.checked_out = 0
+        self.closed = 0
+        self.threads = set()
+
+    def getconn(self):
+        self.threads.add(threading.get_ident())
+        if isinstance(self.error, RuntimeError):
+            raise self.error
+        self.checked_out += 1
+        return FakeConnection(self)
+
+    def putconn(self, conn, close=False):
+        self.checked_out -= 1
+        self.closed += close
+
+
+PRIMARY = object()
+
+
+def replica(name, lag=0.0, checked_at=None):
+    pool = main.ReplicaPool(name)
+    pool.pool = FakePool(lag)
+    pool.lag = lag
+    pool.checked_at = time.time() if checked_at is None else checked_at
+    return pool
+
+
+@pytest.fixture
+def replicas(monkeypatch):
+    pools = [replica("replica-a:5432"), replica("replica-b:5432")]
+    monkeypatch.setattr(main, "replica_pools", pools)
+    monkeypatch.setattr(main, "_replica_cursor", 0)
+    monkeypatch.setattr(main, "_recent_writers", {})
+    monkeypatch.setattr(main, "_conn_owner", {})
+    monkeypatch.setattr(main, "get_db_connection", lambda: PRIMARY)
+    return pools
+
+
+def read_targets(count, client_id=None):
+    targets = []
+    for _ in range(count):
+        conn = main.get_read_connection(client_id)
+        if conn is PRIMARY:
+            targets.append("primary")
+        else:
+            targets.append(conn.pool)
+            main.return_db_connection(conn)
+    return targets
+
+
+def test_reads_round_robin_over_replicas(replicas):
+    a, b = replicas
+    assert read_targets(4) == [a.pool, b.pool, a.pool, b.pool]
+    assert a.pool.checked_out == b.pool.checked_out == 0
+
+
+def test_lagging_replica_is_skipped(replicas):
+    a, b = replicas
+    a.lag = main.DB_REPLICA_MAX_LAG + 1
+    assert read_targets(3) == [b.pool, b.pool, b.pool]
+
+
+def test_unreachable_replica_is_skipped(replicas):
+    a, b = replicas
+    a.lag = None
+    assert read_targets(2) == [b.pool, b.pool]
+
+
+def test_stale_lag_check_counts_as_failure(replicas):
+    a, b = replicas
+    a.checked_at = time.time() - main.DB_REPLICA_CHECK_INTERVAL * 3 - 1
+    assert read_targets(2) == [b.pool, b.pool]
+
+
+def test_getconn_failure_marks_replica_and_moves_on(replicas):
+    a, b = replicas
+    a.pool.error = RuntimeError("pool exhausted")
+    assert read_targets(1) == [b.pool]
+    assert a.lag is None
+    assert read_targets(1) == [b.pool]
+
+
+def test_falls_back_to_primary_without_usable_replica(replicas):
+    for pool in replicas:
+        pool.lag = None
+    assert read_targets(2) == ["primary", "primary"]
+
+
+def test_usable_does_no_io(replicas):
+    a, _ = replicas
+    a.pool.error = RuntimeError("request path must not touch the replica")
+    assert a.usable()
+    assert a.pool.threads == set()
+
+
+def test_writer_sticks_to_primary_until_window_expires(replicas, monkeypatch):
+    a, _ = replicas
+    now = time.time()
+    monkeypatch.setattr(main.time, "time", lambda: now)
+    main.mark_client_write("client-1")
+    assert read_targets(2, "client-1") == ["primary", "primary"]
+    # Other clients keep reading from replicas
+    assert read_targets(1, "client-2") == [a.pool]
+
+    now += main.READ_YOUR_WRITES_WINDOW + 0.1
+    for pool in replicas:
+        pool.checked_at = now
+    assert read_targets(1, "client-1") != ["primary"]
+
+
+def test_anonymous_writes_are_not_sticky(replicas):
+    a, b = replicas
+    main.mark_client_write(None)
+    assert read_targets(2) == [a.pool, b.pool]
+
+
+def test_client_key_ignores_peer_address():
+    from starlette.requests import Request
+
+    def request(headers):
+        return Request({"type": "http", "method": "GET", "path": "/", "client": ("10.0.0.1", 1234),
+                        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()]})
+
+    assert main.client_key(request({})) is None
+    assert main.client_key(request({"X-Client-ID": "abc"})) == "abc"
+
+
+def test_refresh_lag_records_lag_and_failures():
+    pool = replica("replica-a:5432", lag=None, checked_at=0)
+    pool.pool.lag = 1.5
+    pool.refresh_lag()
+    assert pool.lag == 1.5 and pool.usable()
+
+    pool.pool.error = ValueError("connection reset")
+    pool.refresh_lag()
+    assert pool.lag is None and not pool.usable()
+    assert pool.pool.closed == 1 and pool.pool.checked_out == 0
+
+
+def test_monitor_refreshes_off_the_event_loop(monkeypatch):
+    monkeypatch.setattr(main, "DB_REPLICA_CHECK_INTERVAL", 0.01)
+    pool = replica("replica-a:5432", lag=None, checked_at=0)
+    pool.pool.lag = 0.5
+
+    async def run():
+        task = asyncio.create_task(pool.monitor())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+    assert pool.lag == 0.5
+    assert pool.pool.threads and loop_thread not in pool.pool.threads
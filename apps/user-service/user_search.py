@@ -0,0 +1,133 @@
+"""
+User search queries for GET /users/search.
+
+Both modes are served from indexes that user-service builds in the background
+at startup with CREATE INDEX CONCURRENTLY, so writes are never blocked:
+
+- prefix: case-insensitive prefix match on username, email or full_name,
+  one text_pattern_ops B-tree index per column (LIKE 'abc%').
+- fuzzy: pg_trgm word similarity against username, email and full_name
+  combined, one GIN trigram index; tolerates typos and matches any word.
+
+Results are keyset-paginated: the cursor carries the sort key of the last row
+returned, so a deep page costs the same as the first one.
+"""
+import json
+import base64
+
+MODES = ("prefix", "fuzzy")
+MIN_QUERY_LENGTH = {"prefix": 2, "fuzzy": 3}
+MAX_QUERY_LENGTH = 100
+
+# Fuzzy queries must use exactly the indexed expression
+SEARCH_DOCUMENT = "lower(username || ' ' || email || ' ' || full_name)"
+
+# Index name -> definition on users
+PREFIX_INDEXES = {
+    "users_username_prefix_idx": "(lower(username) text_pattern_ops)",
+    "users_email_prefix_idx": "(lower(email) text_pattern_ops)",
+    "users_full_name_prefix_idx": "(lower(full_name) text_pattern_ops)",
+}
+
+TRIGRAM_INDEXES = {
+    "users_search_trgm_idx": f"USING gin (({SEARCH_DOCUMENT}) gin_trgm_ops)",
+}
+
+_COLUMNS = "id, username, email, full_name, created_at::text AS created_at, updated_at::text AS updated_at"
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def create_index(cursor, name: str, definition: str):
+    """Build an index on users without blocking writes; needs an autocommit connection.
+
+    An invalid index left behind by an interrupted build is dropped and built again.
+    """
+    # Waits for a build of the same index by another replica, then finds it
+    cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON users {definition}")
+    cursor.execute("""
+        SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND pg_table_is_visible(c.oid)
+    """, (name,))
+    if not cursor.fetchone()[0]:
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        cursor.execute(f"CREATE INDEX CONCURRENTLY {name} ON users {definition}")
+
+
+def encode_cursor(key, user_id: int) -> str:
+    raw = json.dumps([key, user_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, mode: str):
+    """Return the (sort key, id) a cursor was created from"""
+    try:
+        key, user_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor("Invalid cursor") from e
+    key_type = str if mode == "prefix" else (int, float)
+    if not isinstance(key, key_type) or isinstance(key, bool) or not isinstance(user_id, int):
+        raise InvalidCursor("Invalid cursor")
+    return key, user_id
+
+
+def escape_like(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def build_query(q: str, mode: str, limit: int, after=None):
+    """Return (sql, params) selecting up to limit + 1 rows; the extra row tells whether another page exists.
+
+    Each row is the users columns followed by the sort key.
+    """
+    term = q.lower()
+    params = {"limit": limit + 1}
+    if after is not None:
+        params["after_key"], params["after_id"] = after
+
+    if mode == "prefix":
+        params["pattern"] = escape_like(term) + "%"
+        keyset = "AND (lower(username), id) > (%(after_key)s, %(after_id)s)" if after is not None else ""
+        sql = f"""
+            SELECT {_COLUMNS}, lower(username)
+            FROM users
+            WHERE (lower(username) LIKE %(pattern)s
+                   OR lower(email) LIKE %(pattern)s
+                   OR lower(full_name) LIKE %(pattern)s)
+              {keyset}
+            ORDER BY lower(username), id
+            LIMIT %(limit)s
+        """
+    else:
+        params["term"] = term
+        keyset = ("WHERE score < %(after_key)s::real OR (score = %(after_key)s::real AND id > %(after_id)s)"
+                  if after is not None else "")
+        sql = f"""
+            SELECT * FROM (
+                SELECT {_COLUMNS}, word_similarity(%(term)s, {SEARCH_DOCUMENT}) AS score
+                FROM users
+                WHERE %(term)s <%% {SEARCH_DOCUMENT}
+            ) matches
+            {keyset}
+            ORDER BY score DESC, id
+            LIMIT %(limit)s
+        """
+    return sql, params
+
+
+def search(cursor, q: str, mode: str, limit: int, after=None, threshold: float = 0.5):
+    """Run one page of a search; returns (rows, next_cursor) with rows in users column order"""
+    if mode == "fuzzy":
+        # Minimum word_similarity for the indexed <% operator, for this transaction only
+        cursor.execute("SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)", (str(threshold),))
+    sql, params = build_query(q, mode, limit, after)
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][6], rows[-1][0])
+    return [row[:6] for row in rows], next_cursor